@@ -0,0 +1,205 @@
+import math
+import random
+
+from Board import Board
+from DeflectionRules import DEFAULT_RULES
+from LaserController import LaserController
+
+NEIGHBOURS = tuple((row, col) for row in (-1, 0, 1) for col in (-1, 0, 1) if (row, col) != (0, 0))
+
+
+class AtomHeatmap:
+  """AtomHeatmap class approximates per-cell atom probabilities for boards too large for exact inference.
+  A Markov chain over atom layouts moves one atom at a time and only re-evaluates the observed rays passing
+  near the moved atom. Layouts agreeing with every observed shot and guess are counted into the heatmap.
+  The chain carries over between updates so each shot only needs a short run.
+  """
+  def __init__(self, atom_count, side_length=8, rules=DEFAULT_RULES, samples=500, burn_in=200, thinning=5,
+               temperature=0.25, seed=None):
+    """
+    Args:
+        atom_count (int): number of atoms hidden on the board
+        side_length (int, optional): the length of a side of the inner board. Defaults to 8.
+        rules (DeflectionRules, optional): rules of the game variant. Defaults to DEFAULT_RULES.
+        samples (int, optional): chain states counted into the heatmap per update. Defaults to 500.
+        burn_in (int, optional): moves made after new observations before counting. Defaults to 200.
+        thinning (int, optional): moves between counted states. Defaults to 5.
+        temperature (float, optional): how readily moves contradicting more observations are accepted. Defaults to 0.25.
+        seed (int, optional): seed for reproducible heatmaps. Defaults to None.
+    """
+    self._side_length = side_length
+    self._samples = samples
+    self._burn_in = burn_in
+    self._thinning = thinning
+    self._temperature = temperature
+    self._rng = random.Random(seed)
+    self._laser = LaserController(rules)
+    self._cells = [(row, col) for row in range(1, side_length + 1) for col in range(1, side_length + 1)]
+    self._atoms = self._rng.sample(self._cells, atom_count)
+    self._board = [list(row) for row in Board(side_length + 2, self._atoms).get_board()] # atoms move on this board
+    self._known_atoms = set()
+    self._known_empty = set()
+    self._shots = [] # [origin, observed outcome, traced outcome, path]
+    self._mismatches = 0
+    self._heatmap = None
+    self._counted = 0
+
+  def observe_shot(self, row, col, outcome):
+    """Records a shot and what the game returned for it
+
+    Args:
+        row (int): the row from where the shot originated
+        col (int): the column from where the shot originated
+        outcome (tuple | None): the exit position returned by shoot_ray, None for a hit
+
+    Raises:
+        ValueError: if the outcome is not that of a ray that went through the board
+    """
+    if outcome is not None and not isinstance(outcome, tuple):
+      raise ValueError(f"Shot from {str((row, col))} did not go through the board")
+    traced, path = self._trace(row, col)
+    self._shots.append([(row, col), outcome, traced, path])
+    self._mismatches += traced != outcome
+
+  def observe_guess(self, row, col, correct):
+    """Records a guess and whether it was correct, moving the chain's atoms to agree with it
+
+    Args:
+        row (int): row of the guess
+        col (int): column of the guess
+        correct (boolean): what guess_atom returned
+
+    Raises:
+        ValueError: if the guess was not made or contradicts earlier guesses or the number of atoms
+    """
+    if not isinstance(correct, bool):
+      raise ValueError(f"Guess at {str((row, col))} was not made")
+    cell = (row, col)
+    if cell in (self._known_empty if correct else self._known_atoms):
+      raise ValueError(f"Guess at {str(cell)} contradicts an earlier guess")
+    if correct:
+      if cell not in self._atoms:
+        movable = [atom for atom in self._atoms if atom not in self._known_atoms]
+        if not movable:
+          raise ValueError(f"Guess at {str(cell)} finds more than {len(self._atoms)} atoms")
+        self._move(self._rng.choice(movable), cell)
+      self._known_atoms.add(cell)
+    else:
+      if cell in self._atoms:
+        free = [target for target in self._cells if target not in self._known_empty and self._board[target[0]][target[1]] != 'o']
+        if not free:
+          raise ValueError(f"Guess at {str(cell)} leaves no room for {len(self._atoms)} atoms")
+        self._move(cell, self._rng.choice(free))
+      self._known_empty.add(cell)
+
+  def update(self):
+    """Runs the chain and rebuilds the heatmap from the layouts agreeing with every observation. The previous
+    heatmap is kept if the run reached none.
+
+    Returns:
+        list: side_length x side_length rows of atom probabilities, row 1 of the board first
+    """
+    for _ in range(self._burn_in):
+      self._step()
+    counts = [[0] * self._side_length for _ in range(self._side_length)]
+    counted = 0
+    for _ in range(self._samples):
+      for _ in range(self._thinning):
+        self._step()
+      if self._mismatches == 0:
+        counted += 1
+        for row, col in self._atoms:
+          counts[row - 1][col - 1] += 1
+    self._counted = counted
+    if counted:
+      self._heatmap = [[count / counted for count in row] for row in counts]
+    elif self._heatmap is None: # nothing consistent reached yet, fall back to the prior
+      prior = len(self._atoms) / len(self._cells)
+      self._heatmap = [[prior] * self._side_length for _ in range(self._side_length)]
+    return self._heatmap
+
+  def get_heatmap(self):
+    """Gets the heatmap built by the last update
+
+    Returns:
+        (list | None): side_length x side_length rows of atom probabilities, None before the first update
+    """
+    return self._heatmap
+
+  def get_sample_count(self):
+    """Gets how many chain states agreeing with every observation the last update counted
+
+    Returns:
+        int: number of counted states
+    """
+    return self._counted
+
+  def _step(self):
+    """Proposes moving one atom to a neighbouring or random cell and accepts by the change in contradicted shots
+    """
+    movable = [atom for atom in self._atoms if atom not in self._known_atoms]
+    if not movable:
+      return
+    source = self._rng.choice(movable)
+    if self._rng.random() < 0.5:
+      row_step, col_step = self._rng.choice(NEIGHBOURS)
+      target = (source[0] + row_step, source[1] + col_step)
+      if not Board.check_within_board(target[0], target[1], self._side_length):
+        return
+    else:
+      target = self._rng.choice(self._cells)
+    if target in self._known_empty or self._board[target[0]][target[1]] == 'o':
+      return
+
+    previous = self._move(source, target)
+    delta = self._mismatches - previous[0]
+    if delta > 0 and self._rng.random() >= math.exp(-delta / self._temperature):
+      self._move(target, source, previous)
+
+  def _move(self, source, target, restore=None):
+    """Moves an atom and re-traces the shots passing next to either cell. Every position a ray scans
+    or enters lies next to its origin or a position on its path, so other shots can't change.
+
+    Args:
+        source (tuple): (row, col) of the atom
+        target (tuple): (row, col) of the free cell
+        restore (tuple, optional): the value returned by the move being undone, restores its traces. Defaults to None.
+
+    Returns:
+        tuple: (mismatches before the move, [(shot, traced, path) before the move])
+    """
+    self._atoms[self._atoms.index(source)] = target
+    self._board[source[0]][source[1]] = ''
+    self._board[target[0]][target[1]] = 'o'
+    if restore is not None:
+      self._mismatches = restore[0]
+      for shot, traced, path in restore[1]:
+        shot[2], shot[3] = traced, path
+      return restore
+
+    before = (self._mismatches, [])
+    nearby = [(cell[0] + row_step, cell[1] + col_step) for cell in (source, target) for row_step, col_step in NEIGHBOURS]
+    nearby += [source, target]
+    for shot in self._shots:
+      path = shot[3]
+      if any(cell in path for cell in nearby):
+        before[1].append((shot, shot[2], path))
+        traced, path = self._trace(*shot[0])
+        self._mismatches += (traced != shot[1]) - (shot[2] != shot[1])
+        shot[2], shot[3] = traced, path
+    return before
+
+  def _trace(self, row, col):
+    """Traces a ray on the chain's board the way BlackBoxGame.shoot_ray does, without any points accounting
+
+    Args:
+        row (int): the row from where the shot originates
+        col (int): the column from where the shot originates
+
+    Returns:
+        tuple: (exit position or None for a hit, set of the origin and the positions on the path)
+    """
+    pos, _, hit, trajectory = self._laser.trace(self._board, row, col)
+    path = set(trajectory)
+    path.add((row, col))
+    return (None if hit else pos), path
@@ -5,24 +5,59 @@
 # game implementation in Python as described here:
 # https://en.wikipedia.org/wiki/Black_Box_(game)
 
+import threading
+import uuid
+import warnings
+
 from Board import Board
+from DeflectionRules import DEFAULT_RULES
 from LaserController import LaserController
+from Trajectory import Trajectory
 
 class BlackBoxGame:
   """BlackBoxGame class has private data members to hold and update game state and calls
   methods that call other class instance methods (LaserController and Board) to perform functionality
-  related to traversal and building the board.
+  related to traversal and building the board. Rays are traced without touching game state, only the
+  points accounting is locked, so threads can shoot and guess on the same game at once.
   """  
-  def __init__(self, atom_locations):
-    self._board = Board(10, atom_locations).get_board()
-    self._atom_locations = set(atom_locations)
-    self._laser = LaserController()
+  def __init__(self, atom_locations, ray_table=None, rules=DEFAULT_RULES, side_length=8, event_sink=None, game_id=None):
+    """
+    Args:
+        atom_locations (list | int): (row, col) tuples indicating atom locations or an atom mask as built by Board.atom_mask
+        ray_table (RayTablePool, optional): shared precomputed outcomes read instead of traversing the board
+        when the layout is published there with the same rules. Such shots end in the same position and direction
+        but leave no trajectory to print. Defaults to None.
+        rules (DeflectionRules, optional): compiled rules of the game variant. Defaults to DEFAULT_RULES.
+        side_length (int, optional): the length of a side of the inner board. Defaults to 8.
+        event_sink (SQLiteEventSink, optional): records every shot, guess and the final score, once every atom is
+        found or finish is called. Events the sink can't take are counted as dropped there. Defaults to None.
+        game_id (string, optional): identifies the game's events. Defaults to a random UUID when recording events.
+    """
+    self._board = Board(side_length + 2, atom_locations).get_board()
+    # only the count is kept, atoms are read off the board, so a mask is never unpacked into locations
+    self._atom_count = atom_locations.bit_count() if isinstance(atom_locations, int) else len(set(atom_locations))
+    self._found = 0
+    self._rules = rules
+    self._laser = LaserController(rules)
     self._points = 25
     self._guesses = set()
     self._entry_exit_pairs = set()
     self._current_pos = None # (r, c)
     self._current_direction = None
     self._hit_location = None
+    self._trajectory = Trajectory()
+    self._lock = threading.Lock()
+    self._event_sink = event_sink
+    self._finished = False
+    self._game_id = game_id if game_id or event_sink is None else uuid.uuid4().hex
+    self._ray_table = None
+    self._atom_mask = None
+    if ray_table is not None and side_length == 8: # tables are published for 8x8 layouts
+      try:
+        self._atom_mask = atom_locations if isinstance(atom_locations, int) else Board.atom_mask(atom_locations)
+        self._ray_table = ray_table
+      except ValueError: # layouts reaching the border can't be published
+        pass
 
   def shoot_ray(self, row, col):
     """Shoots a laser ray from a valid origin (borders)
@@ -38,40 +73,80 @@ class BlackBoxGame:
         - If an exit occurs, a tuple (row, col) indicating the exit position is returned.
         - If there are insufficient points to shoot the ray a message is returned indicating so.
     """    
-    self._reset_previous()
-    if not self._in_ray_origin(row, col):
-      return False
+    result, score = self._shoot(row, col)
+    if self._event_sink is not None:
+      self._event_sink.offer(self._game_id, 'shot', row, col, result, score)
+    return result
 
-    self._current_direction = self._set_initial_direction(row, col)
-    self._current_pos = (row, col)
-
-    if self._check_border_reflection(): # check for initial reflection
-      self._handle_add_entry_exit_pair((row, col))
-      return self._current_pos
-
-    self._traverse()
-    self._add_laser_trajectory()
-    while not self._in_ray_origin(self._current_pos[0],self._current_pos[1]) and not self._hit_location:
-      self._add_laser_trajectory()
-      self._scan_ahead() # returns correct scan method and invokes
-      self._traverse()
-    if self._hit_location:
-      if not self._has_enough_points((row, col), None):
-        return f"Not enough points to shoot from {str((row,col))}!"
-      self._handle_add_entry_exit_pair((row, col))
-      return None
-    if not self._has_enough_points((row, col), self.get_current_pos()): # args: entry, exit
-      return f"Not enough points to shoot from {str((row,col))}!"
-    self._handle_add_entry_exit_pair((row, col), self.get_current_pos())
-    return self._current_pos
+  def _shoot(self, row, col):
+    """Traces the ray and charges the points for it, see shoot_ray
+
+    Returns:
+        tuple: (what shoot_ray returns, the points after the shot)
+    """
+    ray = self._trace(row, col) if self._in_ray_origin(row, col) else None
+    with self._lock:
+      if ray is None:
+        self._hit_location = None
+        self._trajectory = Trajectory()
+        return False, self._points
+      pos, self._current_direction, hit, self._trajectory, reflected = ray
+      self._current_pos = pos
+      self._hit_location = pos if hit else None
+      if reflected:
+        self._handle_add_entry_exit_pair((row, col))
+        return pos, self._points
+      return self._settle_shot((row, col), None if hit else pos), self._points
+
+  def _trace(self, row, col):
+    """Traces a ray from a valid origin without changing the game, reading the ray table for published layouts
+
+    Args:
+        row (int): the row from where the shot originates
+        col (int): the column from where the shot originates
+
+    Returns:
+        tuple: (position, direction, hit, trajectory, reflected at the border), see LaserController.trace
+    """
+    if self._ray_table is not None and self._ray_table.get_fingerprint() == self._rules.get_fingerprint():
+      try:
+        outcome = self._ray_table.get_outcome(self._atom_mask, row, col)
+      except KeyError:
+        outcome = False # not published, traverse the board
+      if outcome is not False: # the table holds no path, the trajectory is left empty
+        direction = self._ray_table.get_direction(self._atom_mask, row, col)
+        if outcome == 'reflect':
+          return (row, col), direction, False, Trajectory(), True
+        if outcome is None:
+          return self._ray_table.get_hit_location(self._atom_mask, row, col), direction, True, Trajectory(), False
+        return outcome, direction, False, Trajectory(), False
+
+    pos, direction, hit, trajectory = self._laser.trace(self._board, row, col)
+    return pos, direction, hit, trajectory, not hit and not trajectory
 
   def get_board(self):
     """Gets the board
 
     Returns:
-        Board: a board built by the Board instance
+        list: a copy of the board built by the Board instance, as rows of tuples
     """    
-    return self._board
+    return list(self._board)
+
+  def get_rules(self):
+    """Gets the deflection rules of the game variant
+
+    Returns:
+        DeflectionRules: the compiled rules
+    """
+    return self._rules
+
+  def get_game_id(self):
+    """Gets the id the game's events are recorded under
+
+    Returns:
+        string: the game id
+    """
+    return self._game_id
 
   def get_current_direction(self):
     """Gets the current direction the ray is traversing
@@ -82,12 +157,14 @@ class BlackBoxGame:
     return self._current_direction
 
   def set_current_direction(self, direction):
-    """Sets the current direction the ray is traversing
+    """Sets the current direction the ray is traversing. Deprecated, shots set it.
 
     Args:
         direction (string): 'south' | 'north' | 'east' | 'west'
     """    
-    self._current_direction = direction
+    BlackBoxGame._deprecated('set_current_direction')
+    with self._lock:
+      self._current_direction = direction
 
   def get_current_pos(self):
     """Gets the ray tip's current position
@@ -98,12 +175,30 @@ class BlackBoxGame:
     return self._current_pos
 
   def set_current_pos(self, new_pos):
-    """Sets the current position of the ray tip
+    """Sets the current position of the ray tip. Deprecated, shots set it.
 
     Args:
         new_pos (tuple): (row, col) indicating the new position 
     """    
-    self._current_pos = new_pos
+    BlackBoxGame._deprecated('set_current_pos')
+    with self._lock:
+      self._current_pos = new_pos
+
+  def set_hit_location(self, location):
+    """Sets the location a hit on an atom occurred. Deprecated, shots set it.
+
+    Args:
+        location (tuple): (row, col) tuple indicating the position
+    """    
+    BlackBoxGame._deprecated('set_hit_location')
+    with self._lock:
+      self._hit_location = location
+
+  @staticmethod
+  def _deprecated(name):
+    """Warns that a setter left from the step by step ray API is deprecated
+    """
+    warnings.warn(f"BlackBoxGame.{name} is deprecated, shots set the ray state", DeprecationWarning, stacklevel=3)
 
   def get_score(self):
     """Gets the current points count
@@ -113,21 +208,23 @@ class BlackBoxGame:
     """    
     return self._points
 
+  def get_guesses(self):
+    """Gets the positions guessed so far
+
+    Returns:
+        dict: (row, col) of each guess mapped to whether an atom is there
+    """
+    with self._lock:
+      return {guess: self._board[guess[0]][guess[1]] == 'o' for guess in self._guesses}
+
   def atoms_left(self):
     """The count of atoms not guessed correctly
 
     Returns:
         int: number of atoms not guessed correctly
     """    
-    return len(self._atom_locations) - len(self._atom_locations.intersection(self._guesses)) 
-
-  def set_hit_location(self, location):
-    """Sets the location a hit on an atom occurred
-
-    Args:
-        location (tuple): (row, col) tuple indicating the position
-    """    
-    self._hit_location = location
+    with self._lock:
+      return self._atom_count - self._found
 
   def guess_atom(self, row, col):
     """Method to guess the position of an atom
@@ -139,36 +236,49 @@ class BlackBoxGame:
     Returns:
         (boolean | string): returns True if correct, False if not and a message if points not sufficient to make a guess.
     """    
+    with self._lock:
+      new_guess = (row, col) not in self._guesses
+      result = self._guess(row, col)
+      score = self._points
+      finished = result is True and new_guess and not self._finished and self._found == self._atom_count
+      self._finished = self._finished or finished
+    if self._event_sink is not None:
+      self._event_sink.offer(self._game_id, 'guess', row, col, result, score)
+      if finished:
+        self._event_sink.offer(self._game_id, 'final', None, None, None, score)
+    return result
+
+  def finish(self):
+    """Ends the game, recording the final score unless it was recorded when the last atom was found. Call it
+    when a game stops early, e.g. out of points, so the final score still reaches the event sink.
+
+    Returns:
+        int: the final points count
+    """
+    with self._lock:
+      finished = not self._finished
+      self._finished = True
+      score = self._points
+    if finished and self._event_sink is not None:
+      self._event_sink.offer(self._game_id, 'final', None, None, None, score)
+    return score
+
+  def _guess(self, row, col):
+    """Checks the guess and charges the points for it, see guess_atom
+    """
     if self._points < 5:
       return "Not enough points to make a guess!"
     if (row, col) in self._guesses:
       return self._board[row][col] == 'o'
     if self._board[row][col] == 'o':
       self._guesses.add((row, col))
+      self._found += 1
       return True
     else:
       self._guesses.add((row, col))
       self._points -= 5
       return False
 
-  def _reset_previous(self):
-    """Resets the hit location and laser trajectory so that the next shot can be printed without previous data
-    """    
-    self._hit_location = None
-    self._laser.get_trajectory().clear()
-
-  def _set_initial_direction(self, row, col):
-    """Wrapper function that sets the initial direction by calling the method on the LaserController instance.
-
-    Args:
-        row (int): the current row
-        col (int): the current column
-
-    Returns:
-        string: 'south' | 'north' | 'east' | 'west' 
-    """    
-    return self._laser.set_initial_direction(row, col)
-
   def _has_enough_points(self, entry_pos, exit_pos):
     """Checks if plyer has enough points to shoot laser
 
@@ -186,6 +296,21 @@ class BlackBoxGame:
       points_required += 1
     return points_required < self._points
 
+  def _settle_shot(self, entry_pos, exit_pos):
+    """Charges the points for a shot that went through the board if there are enough of them
+
+    Args:
+        entry_pos (tuple): (row, col) indicating entry position
+        exit_pos (tuple | None): (row, col) indicating exit position, None for a hit
+
+    Returns:
+        (tuple | None | string): the exit position, None for a hit or a message if there are insufficient points
+    """
+    if not self._has_enough_points(entry_pos, exit_pos):
+      return f"Not enough points to shoot from {str(entry_pos)}!"
+    self._handle_add_entry_exit_pair(entry_pos, exit_pos)
+    return exit_pos
+
   def _handle_add_entry_exit_pair(self, entry_pos, exit_pos = None):
     """Adds entry/exit coords to the set tracking entry/exits if needed and updates point accordingly.
 
@@ -211,33 +336,16 @@ class BlackBoxGame:
     """    
     return Board.check_valid_ray_origin(self._board, row, col)
 
-  def _check_border_reflection(self):
-    """Wrapper function that calls LaserController instance method 'check_border_reflection' with bound arguments. 
-    Checks if there is a potential deflection between the ray starting position and the next position.
+  def get_trajectory(self):
+    """Gets the positions the last ray travelled through
 
     Returns:
-        boolean: return True if reflection will occur, False if not.
-    """    
-    return self._laser.check_border_reflection(self._board, self.get_current_direction, self.get_current_pos, self.set_current_direction)
-      
-  def _traverse(self):
-    """Wrapper function that calls LaserController instance method 'traverse' with bound arguments. Moves the laser ray one place in the proper direction.
-    """    
-    self._laser.traverse(self._board, self.get_current_direction, self.get_current_pos, self.set_current_pos, self.set_hit_location)
-
-  def _scan_ahead(self):
-    """Wrapper function that calls LaserController instance method 'get_scan_method' with bound arguments. Returns the proper scan method
-    based on the laser's current direction.
-    """    
-    self._laser.get_scan_method(self.get_current_direction)(self._board, self.get_current_pos, self.set_current_direction)
-
-  def _add_laser_trajectory(self):
-    """Wrapper function that calls LaserController instance method 'get_trajectory' and adds the current position.
-    """ 
-    self._laser.get_trajectory().add(self._current_pos)
+        Trajectory: the last ray's trajectory as straight segments, empty for a shot read from a ray table
+    """
+    return self._trajectory
 
   def print_board(self):
     """Calls Board static method 'print_board' which will print the board.
     """    
-    Board.print_board(self._board, self._laser.get_trajectory())
+    Board.print_board(self._board, self._trajectory)
 
@@ -4,6 +4,17 @@ class Board:
   methods for validating input and printing the board.
   """  
   def __init__(self, length, atom_locations):
+    """
+    Args:
+        length (int): the length of a side of the board including ray origins
+        atom_locations (list | int): (row, col) tuples indicating atom locations or an atom mask as built by atom_mask
+
+    Raises:
+        ValueError: if the atom mask has bits set outside the inner board
+    """
+    if isinstance(atom_locations, int):
+      self._board = Board._board_from_mask(length, atom_locations)
+      return
     board = []
     for x in range(0, length):
       row = []
@@ -12,14 +23,14 @@ class Board:
           row.append('o')
         else:
           row.append('')
-      board.append(row)
+      board.append(tuple(row)) # rows are shared by every copy of the board, so they can't be changed
     self._board = board
 
   def get_board(self):
     """Returns a copy of the board
 
     Returns:
-        list: the board
+        list: the board, as rows of tuples
     """    
     return list(self._board)
 
@@ -31,6 +42,81 @@ class Board:
     """    
     return set(self._atom_locations)
 
+  @staticmethod
+  def ray_origins(length):
+    """Lists every valid ray origin in a fixed order: top, bottom, left then right border
+
+    Args:
+        length (int): the length of a side of the board including ray origins. for 8x8 board, the arg would be 10.
+
+    Returns:
+        list: (row, col) tuples of the ray origins
+    """
+    inner = range(1, length - 1)
+    return ([(0, col) for col in inner] + [(length - 1, col) for col in inner] +
+            [(row, 0) for row in inner] + [(row, length - 1) for row in inner])
+
+  @staticmethod
+  def atom_mask(atom_locations, side_length=8):
+    """Packs atom locations into an integer with bit (row - 1) * side_length + (col - 1) set per atom
+
+    Args:
+        atom_locations (iterable): (row, col) tuples indicating atom locations
+        side_length (int, optional): the length of a side of the inner board. Defaults to 8.
+
+    Raises:
+        ValueError: if an atom falls outside the inner board
+
+    Returns:
+        int: the atom mask
+    """
+    mask = 0
+    for row, col in atom_locations:
+      if not Board.check_within_board(row, col, side_length):
+        raise ValueError(f"Atom {str((row, col))} is outside the inner board")
+      mask |= 1 << ((row - 1) * side_length + (col - 1))
+    return mask
+
+  @staticmethod
+  def mask_locations(atom_mask, side_length=8):
+    """Unpacks an atom mask built by atom_mask
+
+    Args:
+        atom_mask (int): the atom mask
+        side_length (int, optional): the length of a side of the inner board. Defaults to 8.
+
+    Raises:
+        ValueError: if the mask has bits set outside the inner board
+
+    Returns:
+        list: (row, col) tuples indicating atom locations
+    """
+    if atom_mask < 0 or atom_mask >> (side_length * side_length):
+      raise ValueError(f"Atom mask {atom_mask:#x} has atoms outside the inner board")
+    locations = []
+    while atom_mask:
+      index = (atom_mask & -atom_mask).bit_length() - 1
+      locations.append((index // side_length + 1, index % side_length + 1))
+      atom_mask &= atom_mask - 1
+    return locations
+
+  @staticmethod
+  def _board_from_mask(length, atom_mask):
+    """Builds the board rows straight from the bits of an atom mask
+
+    Returns:
+        list: the board, as rows of tuples
+    """
+    side_length = length - 2
+    if atom_mask < 0 or atom_mask >> (side_length * side_length):
+      raise ValueError(f"Atom mask {atom_mask:#x} has atoms outside the inner board")
+    board = [[''] * length for _ in range(length)]
+    while atom_mask:
+      index = (atom_mask & -atom_mask).bit_length() - 1
+      board[index // side_length + 1][index % side_length + 1] = 'o'
+      atom_mask &= atom_mask - 1
+    return [tuple(row) for row in board]
+
   @staticmethod
   def check_valid_ray_origin(board, row, col):
     """Checks if the ray is being shot from a valid position
@@ -71,8 +157,9 @@ class Board:
 
     Args:
         board (Board): a board built by the Board class
-        trajectory_coords (set): set of tuples indicating the trajectory the ray took
+        trajectory_coords (set | Trajectory): the positions the ray took
     """    
+    trajectory_coords = set(trajectory_coords) # one pass over the segments instead of a lookup per cell
     for row in range(1, len(board) - 1):
       pretty_row = ""
       for col in range(1, len(board) - 1):
@@ -84,3 +171,10 @@ class Board:
           pretty_row += " _ "
       print(pretty_row)
 
+
+# ray origins of the 8x8 board in ray_origins order, and the outcome codes ray tables and bulk scoring store
+RAY_ORIGINS = tuple(Board.ray_origins(10))
+ORIGIN_INDEX = {origin: index for index, origin in enumerate(RAY_ORIGINS)}
+HIT = 0xFE
+HIT_CELL = 0x40 # a hit on the atom at (row, col) is stored as HIT_CELL + (row - 1) * 8 + (col - 1)
+REFLECT = 0xFF
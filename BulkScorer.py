@@ -0,0 +1,150 @@
+import heapq
+from array import array
+
+from Board import HIT, ORIGIN_INDEX, REFLECT
+
+SHOT = 0
+GUESS = 1
+
+
+class ScoringEvents:
+  """ScoringEvents class holds recorded shots and guesses of many 8x8 games as parallel columns, in play order
+  within each game:
+  - games: index of the game the event belongs to
+  - kinds: SHOT or GUESS
+  - cells: the origin index (Board.ray_origins order) of a shot, row * 10 + col of a guess
+  - outcomes: the exit's origin index, HIT or REFLECT (a reflection at the border) for a shot, 1 or 0 for
+    a correct or wrong guess
+  """
+  def __init__(self):
+    self.games = array('L')
+    self.kinds = array('B')
+    self.cells = array('B')
+    self.outcomes = array('B')
+
+  def __len__(self):
+    return len(self.games)
+
+  def add_shot(self, game, row, col, result, border_reflection=False):
+    """Appends a shot. Shots from invalid origins change nothing and are skipped.
+
+    Args:
+        game (int): index of the game
+        row (int): the row from where the shot originated
+        col (int): the column from where the shot originated
+        result (tuple | None): the exit position, None for a hit
+        border_reflection (bool, optional): whether the ray was reflected between its origin and the first
+        position, which the game charges without checking points. Defaults to False.
+
+    Raises:
+        ValueError: if the exit is not a ray origin of the 8x8 board
+    """
+    if (row, col) not in ORIGIN_INDEX:
+      return
+    if border_reflection:
+      outcome = REFLECT
+    elif result is None:
+      outcome = HIT
+    elif result in ORIGIN_INDEX:
+      outcome = ORIGIN_INDEX[result]
+    else:
+      raise ValueError(f"Exit {str(result)} is not a ray origin of the 8x8 board")
+    self._append(game, SHOT, ORIGIN_INDEX[(row, col)], outcome)
+
+  def add_guess(self, game, row, col, correct):
+    """Appends a guess
+
+    Args:
+        game (int): index of the game
+        row (int): row of the guess
+        col (int): column of the guess
+        correct (bool): whether an atom is at the guessed position
+
+    Raises:
+        ValueError: if the position is off the 8x8 board and its ray origins, where row * 10 + col would collide
+    """
+    if not (0 <= row < 10 and 0 <= col < 10):
+      raise ValueError(f"Guess at {str((row, col))} is off the 8x8 board")
+    self._append(game, GUESS, row * 10 + col, 1 if correct else 0)
+
+  def _append(self, game, kind, cell, outcome):
+    self.games.append(game)
+    self.kinds.append(kind)
+    self.cells.append(cell)
+    self.outcomes.append(outcome)
+
+
+class BulkScorer:
+  """BulkScorer class computes final scores and atoms left for many games in one pass over columnar events,
+  applying the point rules of BlackBoxGame without replaying any ray: 1 point per border position not
+  used before, 5 per wrong guess, nothing for repeats, shots only if the points they could cost stay below
+  the points left (reflections at the border excepted) and guesses only with 5 points or more.
+  """
+  @staticmethod
+  def score(game_count, atom_counts, events):
+    """Scores every game
+
+    Args:
+        game_count (int): number of games, events refer to them by index below this
+        atom_counts (int | sequence): atoms per game, or one count for all games
+        events (ScoringEvents): the recorded events
+
+    Returns:
+        tuple: (scores, atoms_left) as arrays indexed by game
+    """
+    points = array('l', [25]) * game_count
+    used_ports = [0] * game_count # bit per origin index
+    guessed = [0] * game_count # bit per row * 10 + col
+    found = array('l', [0]) * game_count
+
+    for game, kind, cell, outcome in zip(events.games, events.kinds, events.cells, events.outcomes):
+      left = points[game]
+      if kind == SHOT:
+        ports = used_ports[game]
+        entry = 1 << cell
+        if outcome == REFLECT:
+          if not ports & entry:
+            points[game] = left - 1
+            used_ports[game] = ports | entry
+          continue
+        if outcome == HIT:
+          new_ports = entry & ~ports
+          required = (new_ports != 0) + 1 # the missing exit counts as unused
+        else:
+          exit = 1 << outcome
+          new_ports = (entry | exit) & ~ports
+          required = (not ports & entry) + (not ports & exit)
+        if required < left:
+          points[game] = left - bin(new_ports).count('1')
+          used_ports[game] = ports | new_ports
+      elif left >= 5:
+        bit = 1 << cell
+        if not guessed[game] & bit:
+          guessed[game] |= bit
+          if outcome:
+            found[game] += 1
+          else:
+            points[game] = left - 5
+
+    if isinstance(atom_counts, int):
+      atoms_left = array('l', [atom_counts - count for count in found])
+    else:
+      atoms_left = array('l', [atom_count - count for atom_count, count in zip(atom_counts, found)])
+    return points, atoms_left
+
+  @staticmethod
+  def leaderboard(scores, k, atoms_left=None):
+    """Gets the k best scores with a bounded heap instead of sorting every game
+
+    Args:
+        scores (sequence): score per game
+        k (int): number of entries
+        atoms_left (sequence, optional): atoms left per game, only games with none left are ranked when given. Defaults to None.
+
+    Returns:
+        list: (game index, score) tuples, best first, ties in game order
+    """
+    games = range(len(scores))
+    if atoms_left is not None:
+      games = (game for game in games if atoms_left[game] == 0)
+    return [(game, scores[game]) for game in heapq.nlargest(k, games, key=scores.__getitem__)]
@@ -0,0 +1,165 @@
+import hashlib
+
+DIRECTIONS = ('north', 'east', 'south', 'west') # clockwise, so a right turn is the next direction
+DIRECTION_INDEX = {direction: index for index, direction in enumerate(DIRECTIONS)}
+STEPS = {'north': (-1, 0), 'south': (1, 0), 'east': (0, 1), 'west': (0, -1)} # (row, col) per move
+# what a scanned position holds: empty, an atom or None for outside the inner board
+CELL_STATES = ('', 'o', None)
+STATE_INDEX = {state: index for index, state in enumerate(CELL_STATES)}
+TURNS = {'pass': 0, 'turn_right': 1, 'reverse': 2, 'turn_left': 3}
+
+# Rule sets list ((ahead_left, ahead, ahead_right), action) patterns relative to the direction of travel.
+# The first matching pattern wins, '*' matches any position and unmatched positions pass straight through.
+# 'inner' rules apply inside the board ('pass', 'turn_left', 'turn_right' or 'reverse'), 'edge' rules
+# apply between a ray origin and the first position ('pass' or 'reflect').
+STANDARD = {
+  'name': 'standard',
+  'inner': [
+    (('*', 'o', '*'), 'pass'), # the ray runs into the atom ahead
+    (('o', '*', 'o'), 'reverse'),
+    (('o', '*', '*'), 'turn_right'),
+    (('*', '*', 'o'), 'turn_left'),
+  ],
+  'edge': [
+    (('*', 'o', '*'), 'pass'),
+    (('o', '*', '*'), 'reflect'),
+    (('*', '*', 'o'), 'reflect'),
+  ],
+}
+
+NO_EDGE_REFLECTION = {
+  'name': 'no_edge_reflection',
+  'inner': STANDARD['inner'],
+  'edge': [],
+}
+
+DOUBLE_DEFLECTION_PASS = {
+  'name': 'double_deflection_pass',
+  'inner': [
+    (('*', 'o', '*'), 'pass'),
+    (('o', '*', 'o'), 'pass'),
+    (('o', '*', '*'), 'turn_right'),
+    (('*', '*', 'o'), 'turn_left'),
+  ],
+  'edge': [
+    (('*', 'o', '*'), 'pass'),
+    (('o', '*', 'o'), 'pass'),
+    (('o', '*', '*'), 'reflect'),
+    (('*', '*', 'o'), 'reflect'),
+  ],
+}
+
+
+class DeflectionRules:
+  """DeflectionRules class compiles a rule set into lookup tables indexed by
+  (direction, ahead-left, ahead, ahead-right) so each step of a ray is a single lookup whatever the variant.
+  """
+  def __init__(self, rules=STANDARD):
+    """
+    Args:
+        rules (dict, optional): a rule set with 'name', 'inner' and 'edge' entries. Defaults to STANDARD.
+
+    Raises:
+        ValueError: if a rule uses an unknown position state or an action not allowed where it applies
+    """
+    DeflectionRules._validate(rules['inner'], TURNS)
+    DeflectionRules._validate(rules['edge'], ('pass', 'reflect'))
+    self._name = rules['name']
+    directions = []
+    reflections = []
+    for direction in DIRECTIONS:
+      for ahead_left in CELL_STATES:
+        for ahead in CELL_STATES:
+          for ahead_right in CELL_STATES:
+            scanned = (ahead_left, ahead, ahead_right)
+            turn = TURNS[DeflectionRules._match(rules['inner'], scanned)]
+            directions.append(DIRECTIONS[(DIRECTION_INDEX[direction] + turn) % 4])
+            reflections.append(DeflectionRules._match(rules['edge'], scanned) == 'reflect')
+    self._directions = tuple(directions)
+    self._reflections = tuple(reflections)
+    compiled = bytes(DIRECTION_INDEX[direction] for direction in directions) + bytes(reflections)
+    self._fingerprint = int.from_bytes(hashlib.blake2b(compiled, digest_size=8).digest(), 'little')
+
+  def __eq__(self, other):
+    return (isinstance(other, DeflectionRules) and self._directions == other._directions and
+            self._reflections == other._reflections)
+
+  def __hash__(self):
+    return hash((self._directions, self._reflections))
+
+  def get_fingerprint(self):
+    """Gets a digest of the compiled tables that is the same in every process, equal for equal rules
+
+    Returns:
+        int: 64-bit fingerprint
+    """
+    return self._fingerprint
+
+  def get_name(self):
+    """Gets the name of the rule set
+
+    Returns:
+        string: the rule set name
+    """
+    return self._name
+
+  def compute_direction(self, direction, ahead_left, ahead, ahead_right):
+    """Looks up the direction a ray takes inside the board
+
+    Args:
+        direction (string): 'south' | 'north' | 'east' | 'west', the current direction
+        ahead_left (string | None): what the position ahead and to the left holds ('o', '' or None)
+        ahead (string | None): what the position ahead holds
+        ahead_right (string | None): what the position ahead and to the right holds
+
+    Returns:
+        string: 'south' | 'north' | 'east' | 'west'
+    """
+    return self._directions[DIRECTION_INDEX[direction] * 27 + STATE_INDEX[ahead_left] * 9 +
+                            STATE_INDEX[ahead] * 3 + STATE_INDEX[ahead_right]]
+
+  def check_reflection(self, direction, ahead_left, ahead, ahead_right):
+    """Looks up whether a ray is reflected between its origin and the first position
+
+    Args:
+        direction (string): 'south' | 'north' | 'east' | 'west', the initial direction
+        ahead_left (string | None): what the position ahead and to the left holds ('o', '' or None)
+        ahead (string | None): what the position ahead holds
+        ahead_right (string | None): what the position ahead and to the right holds
+
+    Returns:
+        boolean: whether the ray is reflected
+    """
+    return self._reflections[DIRECTION_INDEX[direction] * 27 + STATE_INDEX[ahead_left] * 9 +
+                             STATE_INDEX[ahead] * 3 + STATE_INDEX[ahead_right]]
+
+  @staticmethod
+  def _validate(patterns, allowed):
+    """Checks every pattern has three known position states and an allowed action
+
+    Raises:
+        ValueError: if a pattern is malformed
+    """
+    for pattern, action in patterns:
+      if action not in allowed:
+        raise ValueError(f"Action {action!r} is not one of {', '.join(allowed)}")
+      if len(pattern) != 3:
+        raise ValueError(f"Pattern {pattern!r} does not have (ahead_left, ahead, ahead_right) positions")
+      for expected in pattern:
+        if expected != '*' and expected not in STATE_INDEX:
+          raise ValueError(f"Position state {expected!r} is not one of 'o', '', None or '*'")
+
+  @staticmethod
+  def _match(patterns, scanned):
+    """Finds the action of the first pattern matching the scanned positions
+
+    Returns:
+        string: the action, 'pass' if no pattern matches
+    """
+    for pattern, action in patterns:
+      if all(expected == '*' or expected == state for expected, state in zip(pattern, scanned)):
+        return action
+    return 'pass'
+
+
+DEFAULT_RULES = DeflectionRules()
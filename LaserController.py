@@ -1,75 +1,76 @@
+import warnings
+from functools import partial
+
 from Board import Board
+from DeflectionRules import DEFAULT_RULES, STEPS
+from Trajectory import Trajectory
 
 class LaserController:
-  """LaserController class contains trajectory data member that indicates the laser's trajectory. Contains methods
-  that scan the positions ahead of the laser's tip, change direction based on the atoms found by scanning ahead and
-  performing traversal based on computed direction. 
+  """LaserController class traces laser rays across a board: it scans the positions ahead of the laser's tip,
+  changes direction based on the atoms found by scanning ahead and moves the ray on in the computed direction.
+  trace reads no state besides the compiled rules, so one controller can trace any number of rays at once.
   """  
-  def __init__(self):
-    self._trajectory = set()
+  def __init__(self, rules=DEFAULT_RULES):
+    """
+    Args:
+        rules (DeflectionRules, optional): compiled rules the ray follows. Defaults to DEFAULT_RULES.
+    """
+    self._rules = rules
+    self._trajectory = Trajectory() # only kept by the deprecated step by step API
 
   def add_trajectory_coord(self, coord):
-    """Adds a coord to the trajectory data member
+    """Adds a coord to the trajectory data member. Deprecated, trace returns the trajectory of each ray.
 
     Args:
-        coord (set): (row, col) tuple set indicating the movement a ray made
+        coord (tuple): (row, col) tuple indicating the movement a ray made
     """    
+    _deprecated('add_trajectory_coord')
     self._trajectory.add(coord)
 
   def get_trajectory(self):
-    """Gets the trajectory set
+    """Gets the trajectory. Deprecated, trace returns the trajectory of each ray.
 
     Returns:
-        set: the trajectory the laser made for a particular shot
+        Trajectory: the positions added with add_trajectory_coord
     """    
+    _deprecated('get_trajectory')
     return self._trajectory
 
   def check_border_reflection(self, board, get_current_direction, get_current_pos, set_direction):
     """Checks if there is a reflection between the ray's starting point and the next position that
-    the ray should travel to
+    the ray should travel to. Deprecated, use trace.
 
     Args:
         board (Board): board built by the Board class
-        get_current_direction (function): passed in by BlackBoxGame that gets the current direction of the ray
-        get_current_pos (function): passed in by BlackBoxGame that gets the current position of the ray
-        set_direction (function): passed in by BlackBoxGame that sets the current direction of the ray
+        get_current_direction (function): gets the current direction of the ray
+        get_current_pos (function): gets the current position of the ray
+        set_direction (function): sets the current direction of the ray
 
     Returns:
         boolean: whether there is a reflection between the ray origin and the next position
     """    
-    if get_current_direction() == 'east':
-      north_east, south_east, east_pos = self._scan_east_and_compute_direction(board, get_current_pos, set_direction)
-      if (north_east == 'o' or south_east == 'o') and east_pos != 'o':
-        return True
-
-    if get_current_direction() == 'west':
-      north_west, south_west, west = self._scan_west_and_compute_direction(board, get_current_pos, set_direction)
-      if (north_west == 'o' or south_west == 'o') and west != 'o':
-        return True
-
-    if get_current_direction() == 'north':
-      north_west, north_east, north = self._scan_north_and_compute_direction(board, get_current_pos, set_direction)
-      if (north_west == 'o' or north_east == 'o') and north != 'o':
-        return True
+    _deprecated('check_border_reflection')
+    direction = get_current_direction()
+    scanned = self._scan(board, get_current_pos(), direction)
+    if self._rules.check_reflection(direction, *scanned):
+      set_direction(self._rules.compute_direction(direction, *scanned))
+      return True
+    return False
 
-    if get_current_direction() == 'south':
-      south_west, south_east, south = self._scan_south_and_compute_direction(board, get_current_pos, set_direction)
-      if (south_west == 'o' or south_east == 'o') and south != 'o':
-        return True
-    
-  def set_initial_direction(self, origin_row, origin_col):
+  def set_initial_direction(self, origin_row, origin_col, length=10):
     """Sets the initial direction of the ray
 
     Args:
         origin_row (int): the row where the laser was initially placed
         origin_col (int): the column where the laser was initially placed
+        length (int, optional): the length of a side of the board including ray origins. Defaults to 10.
 
     Returns:
         string: 'south' | 'north' | 'east' | 'west' 
     """    
     if origin_row == 0:
       return 'south'
-    elif origin_row == 9:
+    elif origin_row == length - 1:
       return 'north'
     elif origin_col == 0:
       return 'east'
@@ -77,202 +78,101 @@ class LaserController:
       return 'west'
 
   def traverse(self, board, get_current_direction, get_current_pos, set_current_pos, set_hit_location):
-    """Moves the laser ray one place in the proper direction
+    """Moves the laser ray one place in the proper direction. Deprecated, use trace.
 
     Args:
         board (Board): the board created by the Board instance
-        get_current_direction (function): passed from BlackBoxGame that gets the current direction
-        get_current_pos (function): passed from BlackBoxGame that gets the current position as (row, col)
-        set_current_pos (function): passed from BlackBoxGame that sets the current pos (row, col)
-        set_hit_location (function): passed from BlackBoxGame that sets the hit location (laser hitting atom)
+        get_current_direction (function): gets the current direction
+        get_current_pos (function): gets the current position as (row, col)
+        set_current_pos (function): sets the current pos (row, col)
+        set_hit_location (function): sets the hit location (laser hitting atom)
     """    
-    direction = get_current_direction()
-    current_row = get_current_pos()[0]
-    current_col = get_current_pos()[1]
-
-    if direction == 'north':
-      set_current_pos((current_row - 1, current_col))
-    elif direction == 'south':
-      set_current_pos((current_row + 1, current_col))
-    elif direction == 'east':
-      set_current_pos((current_row, current_col + 1))
-    else: # west
-      set_current_pos((current_row, current_col - 1))
-    # hit registered
-    new_row = get_current_pos()[0]
-    new_col = get_current_pos()[1]
-    if board[new_row][new_col] == 'o':
-      set_hit_location(get_current_pos)
+    _deprecated('traverse')
+    row_step, col_step = STEPS[get_current_direction()]
+    row, col = get_current_pos()
+    set_current_pos((row + row_step, col + col_step))
+    if board[row + row_step][col + col_step] == 'o':
+      set_hit_location((row + row_step, col + col_step))
 
   def get_scan_method(self, get_current_direction):
-    """Gets the appropriate scan ahead method from current direction
-
-    Args:
-        get_current_direction (function): passed from BlackBoxGame that gets the current direction the ray is travelling in
-
-    Returns:
-        function: the function that scans ahead relative to the direction the ray is traversing in
-    """    
-    direction = get_current_direction()
-    if direction == 'north':
-      return self._scan_north_and_compute_direction
-    elif direction == 'south':
-      return self._scan_south_and_compute_direction
-    elif direction == 'east':
-      return self._scan_east_and_compute_direction
-    else: # west
-      return self._scan_west_and_compute_direction
-
-
-  def _scan_north_and_compute_direction(self, board, get_current_pos, set_direction):
-    """Scans the positions north of the ray, sets the direction based on atoms ahead and returns
-    a tuple showing what was found ahead ('o' or empty or None, None being outside of the inner board)
-
-    Args:
-        board (Board): the board created by the Board instance
-        get_current_pos (function): passed from BlackBoxGame that gets the current position as (row, col)
-        set_direction (function): passed in by BlackBoxGame that sets the current direction of the ray
-
-    Returns:
-        tuple: tuple showing what was found ahead ('o' or empty or None, None being outside of the inner board)
-    """ 
-    current_row = get_current_pos()[0]
-    current_col = get_current_pos()[1]
-    north_west = None
-    north_east = None
-    next_pos = None
-    
-    if Board.check_within_board(current_row - 1, current_col - 1, len(board) - 2):
-      north_west = board[current_row - 1][current_col - 1]
-
-    if Board.check_within_board(current_row - 1, current_col + 1, len(board) - 2):
-      north_east = board[current_row - 1][current_col + 1]
-
-    if Board.check_within_board(current_row - 1, current_col, len(board) - 2):
-      next_pos = board[current_row - 1][current_col]
-
-    if north_west == 'o' and north_east == 'o' and next_pos != 'o':
-      set_direction('south')
-
-    if north_west == 'o' and (north_east == '' or not north_east) and next_pos != 'o':
-      set_direction('east')
-    
-    if north_east == 'o' and (north_west == '' or not north_west) and next_pos != 'o':
-      set_direction('west')
-    
-    return (north_west, north_east, next_pos)
-
-  def _scan_south_and_compute_direction(self, board, get_current_pos, set_direction):
-    """Scans the positions south of the ray, sets the direction based on atoms ahead and returns
-    a tuple showing what was found ahead ('o' or empty or None, None being outside of the inner board)
+    """Gets the scan ahead method for the current direction. Deprecated, use trace.
 
     Args:
-        board (Board): the board created by the Board instance
-        get_current_pos (function): passed from BlackBoxGame that gets the current position as (row, col)
-        set_direction (function): passed in by BlackBoxGame that sets the current direction of the ray
+        get_current_direction (function): gets the current direction the ray is travelling in
 
     Returns:
-        tuple: tuple showing what was found ahead ('o' or empty or None, None being outside of the inner board)
-    """    
-    current_row = get_current_pos()[0]
-    current_col = get_current_pos()[1]
-    south_west = None
-    south_east = None
-    next_pos = None
-    
-    if Board.check_within_board(current_row + 1, current_col - 1, len(board) - 2):
-      south_west = board[current_row + 1][current_col - 1]
-
-    if Board.check_within_board(current_row + 1, current_col + 1, len(board) - 2):
-      south_east = board[current_row + 1][current_col + 1]
-
-    if Board.check_within_board(current_row + 1,current_col, len(board) - 2):
-      next_pos = board[current_row + 1][current_col] 
-
-    if south_west == 'o' and south_east == 'o' and next_pos != 'o':
-      set_direction('north')
-
-    if south_west == 'o' and (south_east == '' or not south_east) and next_pos != 'o':
-      set_direction('east')
-    
-    if south_east == 'o' and (south_west == '' or not south_west) and next_pos != 'o':
-      set_direction('west')
-    
-    return (south_west, south_east, next_pos)
-
-  def _scan_east_and_compute_direction(self, board, get_current_pos, set_direction):
-    """Scans the positions east of the ray, sets the direction based on atoms ahead and returns
-    a tuple showing what was found ahead ('o' or empty or None, None being outside of the inner board)
+        function: takes the board, a function getting the current position and one setting the direction,
+        sets the direction looked up from the deflection rules and returns (ahead_left, ahead, ahead_right)
+    """
+    _deprecated('get_scan_method')
+    return partial(self._scan_and_compute_direction, direction=get_current_direction())
+
+  def _scan_and_compute_direction(self, board, get_current_pos, set_direction, direction):
+    """Scans ahead of the ray and sets the direction the deflection rules give, see get_scan_method
+    """
+    scanned = self._scan(board, get_current_pos(), direction)
+    set_direction(self._rules.compute_direction(direction, *scanned))
+    return scanned
+
+  def trace(self, board, origin_row, origin_col):
+    """Traces a ray from its origin to where it exits or hits, the way BlackBoxGame shoots it. Only the
+    board and the compiled rules are read and the trajectory is built per call, so any number of threads
+    can trace rays on the same board at once.
 
     Args:
-        board (Board): the board created by the Board instance
-        get_current_pos (function): passed from BlackBoxGame that gets the current position as (row, col)
-        set_direction (function): passed in by BlackBoxGame that sets the current direction of the ray
+        board (Board): the board created by the Board instance, left unchanged
+        origin_row (int): the row of a valid ray origin
+        origin_col (int): the column of a valid ray origin
 
     Returns:
-        tuple: tuple showing what was found ahead ('o' or empty or None, None being outside of the inner board)
-    """     
-    current_row = get_current_pos()[0]
-    current_col = get_current_pos()[1]
-    north_east = None
-    south_east = None
-    next_pos = None
-    
-    if Board.check_within_board(current_row - 1, current_col + 1, len(board) - 2):
-      north_east = board[current_row - 1][current_col + 1]
-
-    if Board.check_within_board(current_row + 1, current_col + 1, len(board) - 2):
-      south_east = board[current_row + 1][current_col + 1]
-
-    if Board.check_within_board(current_row, current_col + 1, len(board) - 2):
-      next_pos = board[current_row][current_col + 1]
-    
-    if north_east == 'o' and south_east == 'o' and next_pos != 'o':
-      set_direction('west')
-
-    if north_east == 'o' and (south_east == '' or not south_east) and next_pos != 'o':
-      set_direction('south')
-    
-    if south_east == 'o' and (north_east == '' or not north_east) and next_pos != 'o':
-      set_direction('north')
-
-    return (north_east, south_east, next_pos)
-
-  def _scan_west_and_compute_direction(self, board, get_current_pos, set_direction):
-    """Scans the positions west of the ray, sets the direction based on atoms ahead and returns
-    a tuple showing what was found ahead ('o' or empty or None, None being outside of the inner board)
+        tuple: (position, direction, hit, trajectory) where position is the exit, the atom hit or the origin for
+        a ray reflected at the border, which also leaves the trajectory empty
+    """
+    rules = self._rules
+    pos = (origin_row, origin_col)
+    direction = self.set_initial_direction(origin_row, origin_col, len(board))
+    trajectory = Trajectory()
+    scanned = self._scan(board, pos, direction)
+    if rules.check_reflection(direction, *scanned):
+      return pos, rules.compute_direction(direction, *scanned), False, trajectory
+
+    while True:
+      row_step, col_step = STEPS[direction]
+      pos = (pos[0] + row_step, pos[1] + col_step)
+      if board[pos[0]][pos[1]] == 'o':
+        if not trajectory: # only a hit on the first step is part of the trajectory
+          trajectory.add(pos)
+        return pos, direction, True, trajectory
+      if Board.check_valid_ray_origin(board, pos[0], pos[1]):
+        return pos, direction, False, trajectory
+      trajectory.add(pos)
+      direction = rules.compute_direction(direction, *self._scan(board, pos, direction))
+
+  def _scan(self, board, pos, direction):
+    """Reads the three positions ahead of the ray
 
     Args:
         board (Board): the board created by the Board instance
-        get_current_pos (function): passed from BlackBoxGame that gets the current position as (row, col)
-        set_direction (function): passed in by BlackBoxGame that sets the current direction of the ray
+        pos (tuple): (row, col) of the ray tip
+        direction (string): 'south' | 'north' | 'east' | 'west', the direction the ray is travelling in
 
     Returns:
-        tuple: tuple showing what was found ahead ('o' or empty or None, None being outside of the inner board)
-    """     
-    current_row = get_current_pos()[0]
-    current_col = get_current_pos()[1]
-
-    north_west = None
-    south_west = None
-    next_pos = None
-    
-    if Board.check_within_board(current_row - 1, current_col - 1, len(board) - 2):
-      north_west = board[current_row - 1][current_col - 1]
-
-    if Board.check_within_board(current_row + 1, current_col - 1, len(board) - 2):
-      south_west = board[current_row + 1][current_col - 1]
-    
-    if Board.check_within_board(current_row, current_col - 1, len(board) - 2):
-      next_pos = board[current_row][current_col - 1]
-
-    if north_west == 'o' and south_west == 'o' and next_pos != 'o':
-      set_direction('east')
-
-    if north_west == 'o' and (south_west == '' or not south_west) and next_pos != 'o':
-      set_direction('south')
-    
-    if south_west == 'o' and (north_west == '' or not north_west) and next_pos != 'o':
-      set_direction('north')
-    
-    return (north_west, south_west, next_pos)
+        tuple: (ahead_left, ahead, ahead_right), each 'o', '' or None for outside of the inner board
+    """
+    row_step, col_step = STEPS[direction]
+    ahead_row = pos[0] + row_step
+    ahead_col = pos[1] + col_step
+    last = len(board) - 2 # inner board cells are 1..last, checked inline as this runs on every step
+    # left of (row_step, col_step) is (-col_step, row_step)
+    row, col = ahead_row - col_step, ahead_col + row_step
+    ahead_left = board[row][col] if 1 <= row <= last and 1 <= col <= last else None
+    ahead = board[ahead_row][ahead_col] if 1 <= ahead_row <= last and 1 <= ahead_col <= last else None
+    row, col = ahead_row + col_step, ahead_col - row_step
+    ahead_right = board[row][col] if 1 <= row <= last and 1 <= col <= last else None
+    return ahead_left, ahead, ahead_right
+
+
+def _deprecated(name):
+  """Warns that a method of the step by step ray API is deprecated in favour of trace
+  """
+  warnings.warn(f"LaserController.{name} is deprecated, use LaserController.trace", DeprecationWarning, stacklevel=3)
@@ -0,0 +1,255 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from Board import Board
+
+# header: magic, format version, byte order (0 little, 1 big), column count, layout count, followed by one
+# COLUMN entry per signature column, the layout masks as uint64 and each signature column in turn, every
+# section starting on an 8 byte boundary
+HEADER = struct.Struct('<4sIIIQ')
+COLUMN = struct.Struct('<32sc7x') # name, array typecode
+FORMAT_VERSION = 1
+MAGIC = b'BBLS'
+BYTE_ORDER = 0 if sys.byteorder == 'little' else 1
+TYPECODES = 'bBhHiIqQfd' # the same width on every platform
+
+
+class LayoutStoreWriter:
+  """LayoutStoreWriter class writes 8x8 atom layouts to a packed file read by LayoutStore: one 64-bit mask
+  per layout, as built by Board.atom_mask, and optional fixed width signature columns. Layouts are streamed
+  to disk in chunks, so corpora larger than memory can be written.
+  """
+  def __init__(self, path, columns=None, chunk_size=65536):
+    """
+    Args:
+        path (string): the file to write, replaced if it exists
+        columns (dict, optional): signature column names mapped to array typecodes, e.g. {'atoms': 'B'}. Defaults to None.
+        chunk_size (int, optional): layouts buffered in memory between writes. Defaults to 65536.
+
+    Raises:
+        ValueError: if a column name or typecode is not supported
+    """
+    self._columns = dict(columns or {})
+    for name, typecode in self._columns.items():
+      if typecode not in TYPECODES:
+        raise ValueError(f"Column {name} has unsupported typecode {typecode!r}")
+      if len(name.encode()) > 32 or name == 'mask':
+        raise ValueError(f"Column name {name!r} is reserved or longer than 32 bytes")
+    self._path = path
+    self._chunk_size = chunk_size
+    self._count = 0
+    self._file = open(path, 'wb')
+    self._file.write(bytes(_align(HEADER.size + COLUMN.size * len(self._columns))))
+    # columns follow all the masks, so they are spilled next to the file until closing
+    self._spills = {name: open(f"{path}.{name}.part", 'w+b') for name in self._columns}
+    self._masks = array('Q')
+    self._values = {name: array(typecode) for name, typecode in self._columns.items()}
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def __len__(self):
+    return self._count
+
+  def append(self, layout, **values):
+    """Appends a layout
+
+    Args:
+        layout (list | int): (row, col) tuples indicating atom locations or an atom mask as built by Board.atom_mask
+        values: a value for every signature column
+
+    Raises:
+        ValueError: if the layout is outside the 8x8 board or the values don't match the columns
+        OverflowError: if a value is out of its column's range
+        TypeError: if a value is not of its column's type
+    """
+    if values.keys() != self._columns.keys():
+      raise ValueError(f"Expected values for columns {sorted(self._columns)}, got {sorted(values)}")
+    if not isinstance(layout, int):
+      layout = Board.atom_mask(layout)
+    elif layout < 0 or layout >> 64:
+      raise ValueError(f"Atom mask {layout:#x} has atoms outside the inner board")
+    # convert every value first, so a rejected one leaves the columns aligned with the masks
+    converted = {name: array(self._columns[name], [value]) for name, value in values.items()}
+    self._masks.append(layout)
+    for name, value in converted.items():
+      self._values[name].extend(value)
+    self._count += 1
+    if len(self._masks) >= self._chunk_size:
+      self._write_chunk()
+
+  def close(self):
+    """Writes out the buffered layouts, appends the signature columns and finishes the header
+    """
+    if self._file is None:
+      return
+    self._write_chunk()
+    for name, spill in self._spills.items():
+      self._file.write(bytes(_align(self._file.tell()) - self._file.tell()))
+      spill.seek(0)
+      while True:
+        data = spill.read(1 << 20)
+        if not data:
+          break
+        self._file.write(data)
+      spill.close()
+      os.remove(spill.name)
+    self._file.seek(0)
+    self._file.write(HEADER.pack(MAGIC, FORMAT_VERSION, BYTE_ORDER, len(self._columns), self._count))
+    for name, typecode in self._columns.items():
+      self._file.write(COLUMN.pack(name.encode(), typecode.encode()))
+    self._file.close()
+    self._file = None
+
+  def _write_chunk(self):
+    self._masks.tofile(self._file)
+    del self._masks[:]
+    for name, values in self._values.items():
+      values.tofile(self._spills[name])
+      del values[:]
+
+
+class LayoutStore:
+  """LayoutStore class reads a file written by LayoutStoreWriter through a read-only memory map. Masks and
+  signature columns are served as memoryviews over the file without copying, so opening a store of any size
+  is instant and only the pages read are loaded.
+  """
+  def __init__(self, path):
+    """
+    Args:
+        path (string): the file written by LayoutStoreWriter
+
+    Raises:
+        ValueError: if the file is not a layout store this version and host can read
+    """
+    with open(path, 'rb') as file:
+      self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    self._buffer = memoryview(self._mmap)
+    try:
+      magic, format_version, byte_order, column_count, count = HEADER.unpack_from(self._buffer)
+    except struct.error:
+      magic = None
+    if magic != MAGIC or format_version != FORMAT_VERSION:
+      self.close()
+      raise ValueError(f"{path} is not a version {FORMAT_VERSION} layout store")
+    if byte_order != BYTE_ORDER:
+      self.close()
+      raise ValueError(f"{path} was written on a host of the other byte order")
+
+    self._count = count
+    sections = [('mask', 'Q')]
+    for index in range(column_count):
+      name, typecode = COLUMN.unpack_from(self._buffer, HEADER.size + COLUMN.size * index)
+      sections.append((name.rstrip(b'\0').decode(), typecode.decode()))
+    offset = _align(HEADER.size + COLUMN.size * column_count)
+    views = {}
+    for name, typecode in sections:
+      size = array(typecode).itemsize * count
+      if offset + size > len(self._buffer):
+        self._release(views)
+        self.close()
+        raise ValueError(f"{path} is truncated")
+      views[name] = self._buffer[offset:offset + size].cast(typecode)
+      offset = _align(offset + size)
+    self._masks = views.pop('mask')
+    self._columns = views
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def __len__(self):
+    return self._count
+
+  def __getitem__(self, index):
+    """Gets the mask of a layout, pass it to BlackBoxGame or Board as is
+
+    Args:
+        index (int): position of the layout in the store
+
+    Returns:
+        int: the atom mask
+    """
+    return self._masks[index]
+
+  def get_columns(self):
+    """Gets the names of the signature columns
+
+    Returns:
+        list: column names in file order
+    """
+    return list(self._columns)
+
+  def get_value(self, name, index):
+    """Gets a layout's value in a signature column
+
+    Args:
+        name (string): the column
+        index (int): position of the layout in the store
+
+    Returns:
+        (int | float): the value
+    """
+    return self._columns[name][index]
+
+  def iter_chunks(self, chunk_size=65536, column='mask'):
+    """Iterates over a column in chunks without copying. Release the views before closing the store.
+
+    Args:
+        chunk_size (int, optional): values per chunk. Defaults to 65536.
+        column (string, optional): 'mask' or a signature column. Defaults to 'mask'.
+
+    Yields:
+        tuple: (index of the chunk's first layout, memoryview of the chunk's values)
+    """
+    values = self._masks if column == 'mask' else self._columns[column]
+    for start in range(0, self._count, chunk_size):
+      yield start, values[start:start + chunk_size]
+
+  def filter(self, predicate, column='mask', chunk_size=65536):
+    """Finds the layouts whose value in a column satisfies a predicate, reading the column chunk by chunk
+
+    Args:
+        predicate (function): called with a mask or column value, returns whether to keep the layout
+        column (string, optional): 'mask' or a signature column. Defaults to 'mask'.
+        chunk_size (int, optional): values read per chunk. Defaults to 65536.
+
+    Yields:
+        int: index of every layout kept
+    """
+    for start, chunk in self.iter_chunks(chunk_size, column):
+      values = chunk.tolist() # don't hold a view of the map while yielding
+      chunk.release()
+      for offset, value in enumerate(values):
+        if predicate(value):
+          yield start + offset
+
+  def close(self):
+    """Releases the views and unmaps the file
+    """
+    if self._mmap is None:
+      return
+    self._release(getattr(self, '_columns', {}))
+    if getattr(self, '_masks', None) is not None:
+      self._masks.release()
+    self._buffer.release()
+    self._mmap.close()
+    self._mmap = None
+
+  def _release(self, views):
+    for view in views.values():
+      view.release()
+
+
+def _align(offset):
+  """Rounds an offset up to the next multiple of 8
+  """
+  return (offset + 7) & ~7
@@ -0,0 +1,404 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import resource
+import threading
+import time
+
+from BlackBoxGame import BlackBoxGame
+from Board import RAY_ORIGINS
+
+OPERATIONS = ('shoot_ray', 'guess_atom')
+MODES = ('threads', 'asyncio', 'processes')
+INNER_CELLS = tuple((row, col) for row in range(1, 9) for col in range(1, 9))
+
+
+class LatencyHistogram:
+  """LatencyHistogram class counts latencies in log-linear buckets: exact below 32ns, then 16 buckets per
+  power of two, so percentiles are within 6.25% and histograms from many players merge by adding counts.
+  """
+  def __init__(self):
+    self._buckets = {}
+    self._count = 0
+    self._total = 0
+    self._max = 0
+
+  def record(self, nanoseconds):
+    """Counts a latency
+
+    Args:
+        nanoseconds (int): the latency
+    """
+    if nanoseconds < 32:
+      bucket = nanoseconds
+    else:
+      exponent = nanoseconds.bit_length() - 5
+      bucket = exponent * 16 + (nanoseconds >> exponent)
+    self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+    self._count += 1
+    self._total += nanoseconds
+    if nanoseconds > self._max:
+      self._max = nanoseconds
+
+  def merge(self, other):
+    """Adds the counts of another histogram
+
+    Args:
+        other (LatencyHistogram): the histogram to add
+    """
+    for bucket, count in other._buckets.items():
+      self._buckets[bucket] = self._buckets.get(bucket, 0) + count
+    self._count += other._count
+    self._total += other._total
+    self._max = max(self._max, other._max)
+
+  def get_count(self):
+    """Gets the number of latencies counted
+
+    Returns:
+        int: the count
+    """
+    return self._count
+
+  def get_mean(self):
+    """Gets the mean latency
+
+    Returns:
+        float: the mean in nanoseconds, 0 if nothing was counted
+    """
+    return self._total / self._count if self._count else 0
+
+  def get_max(self):
+    """Gets the largest latency
+
+    Returns:
+        int: the largest latency in nanoseconds
+    """
+    return self._max
+
+  def get_percentile(self, percentile):
+    """Gets the latency at or below which the given share of latencies fall
+
+    Args:
+        percentile (float): between 0 and 100, e.g. 99.9
+
+    Returns:
+        int: the upper bound of the bucket holding the percentile in nanoseconds, 0 if nothing was counted
+    """
+    rank = percentile / 100 * self._count
+    seen = 0
+    for bucket in sorted(self._buckets):
+      seen += self._buckets[bucket]
+      if seen >= rank:
+        if bucket < 32:
+          return bucket
+        exponent = bucket // 16 - 1
+        return min(((bucket - exponent * 16 + 1) << exponent) - 1, self._max)
+    return 0
+
+
+class LoadGenerator:
+  """LoadGenerator class simulates concurrent players against in-process BlackBoxGame instances and reports
+  shoot_ray and guess_atom latency percentiles, throughput and memory growth. Each player plays one game
+  after another with a mix of shots and guesses until it runs out of points or finds every atom.
+  """
+  def __init__(self, players=8, mode='threads', duration=10, shot_ratio=0.8, atom_count=4, think_time=0,
+               sample_interval=1, seed=None):
+    """
+    Args:
+        players (int, optional): number of concurrent players. Defaults to 8.
+        mode (string, optional): 'threads' | 'asyncio' | 'processes', how players run concurrently. Defaults to 'threads'.
+        duration (float, optional): seconds to run for. Defaults to 10.
+        shot_ratio (float, optional): share of moves that are shots, the rest are guesses. Defaults to 0.8.
+        atom_count (int, optional): atoms per game. Defaults to 4.
+        think_time (float, optional): seconds a player waits between moves. Defaults to 0.
+        sample_interval (float, optional): seconds between memory samples. Defaults to 1.
+        seed (int, optional): seed for reproducible move sequences. Defaults to None.
+
+    Raises:
+        ValueError: if the mode is unknown
+    """
+    if mode not in MODES:
+      raise ValueError(f"Mode {mode!r} is not one of {', '.join(MODES)}")
+    self._players = players
+    self._mode = mode
+    self._duration = duration
+    self._shot_ratio = shot_ratio
+    self._atom_count = atom_count
+    self._think_time = think_time
+    self._sample_interval = sample_interval
+    self._seed = random.randrange(2 ** 32) if seed is None else seed
+
+  def run(self):
+    """Runs the players for the duration
+
+    Returns:
+        dict: 'mode', 'players', 'duration', 'operations' (per operation count, throughput per second and
+        mean/p50/p99/p999/max latency in microseconds) and 'memory' (start, end and growth of the resident
+        set in bytes, summed over the player processes in processes mode, plus (elapsed seconds, bytes) samples)
+    """
+    start = time.perf_counter()
+    deadline = start + self._duration
+    samples = [(0.0, _resident_bytes())]
+    if self._mode == 'threads':
+      histograms = self._run_threads(deadline, start, samples)
+    elif self._mode == 'asyncio':
+      histograms = asyncio.run(self._run_asyncio(deadline, start, samples))
+    else:
+      histograms, samples = self._run_processes(deadline, start)
+    elapsed = time.perf_counter() - start
+    if self._mode != 'processes':
+      samples.append((elapsed, _resident_bytes()))
+    return self._report(histograms, elapsed, samples)
+
+  def _player_seeds(self):
+    """Derives a seed per player from the generator's seed
+    """
+    return [self._seed + index for index in range(self._players)]
+
+  def _run_threads(self, deadline, start, samples):
+    """Runs a thread per player while the calling thread samples memory
+
+    Returns:
+        dict: operation -> merged LatencyHistogram
+    """
+    results = [None] * self._players
+    def play(index, seed):
+      results[index] = _play(seed, deadline, self._shot_ratio, self._atom_count, self._think_time)
+    threads = [threading.Thread(target=play, args=(index, seed), daemon=True)
+               for index, seed in enumerate(self._player_seeds())]
+    for thread in threads:
+      thread.start()
+    while time.perf_counter() < deadline:
+      time.sleep(max(min(self._sample_interval, deadline - time.perf_counter()), 0))
+      samples.append((time.perf_counter() - start, _resident_bytes()))
+    for thread in threads:
+      thread.join()
+    return _merge(results)
+
+  async def _run_asyncio(self, deadline, start, samples):
+    """Runs a task per player plus a memory sampling task
+
+    Returns:
+        dict: operation -> merged LatencyHistogram
+    """
+    async def sample():
+      while time.perf_counter() < deadline:
+        await asyncio.sleep(self._sample_interval)
+        samples.append((time.perf_counter() - start, _resident_bytes()))
+    sampler = asyncio.create_task(sample())
+    results = await asyncio.gather(*[_play_async(seed, deadline, self._shot_ratio, self._atom_count, self._think_time)
+                                     for seed in self._player_seeds()])
+    sampler.cancel()
+    return _merge(results)
+
+  def _run_processes(self, deadline, start):
+    """Runs a process per player, each sampling its own resident set while it plays
+
+    Returns:
+        tuple: (operation -> merged LatencyHistogram, (elapsed seconds, bytes) samples summed over the processes)
+    """
+    epoch = time.time() - (time.perf_counter() - start) # processes share wall clock time, not perf_counter
+    arguments = [(seed, epoch, epoch + deadline - start, self._shot_ratio, self._atom_count, self._think_time,
+                  self._sample_interval) for seed in self._player_seeds()]
+    with multiprocessing.Pool(self._players) as pool:
+      results = pool.map(_play_process, arguments)
+    return (_merge([histograms for histograms, _ in results]),
+            _merge_samples([samples for _, samples in results], self._sample_interval))
+
+  def _report(self, histograms, elapsed, samples):
+    """Builds the report returned by run
+    """
+    operations = {}
+    for operation, histogram in histograms.items():
+      operations[operation] = {
+        'count': histogram.get_count(),
+        'throughput': histogram.get_count() / elapsed,
+        'mean_us': histogram.get_mean() / 1000,
+        'p50_us': histogram.get_percentile(50) / 1000,
+        'p99_us': histogram.get_percentile(99) / 1000,
+        'p999_us': histogram.get_percentile(99.9) / 1000,
+        'max_us': histogram.get_max() / 1000,
+      }
+    return {
+      'mode': self._mode,
+      'players': self._players,
+      'duration': elapsed,
+      'operations': operations,
+      'memory': {
+        'start_bytes': samples[0][1],
+        'end_bytes': samples[-1][1],
+        'growth_bytes': samples[-1][1] - samples[0][1],
+        'samples': samples,
+      },
+    }
+
+
+def _new_game(rng, atom_count):
+  """Starts a game on a random layout with the ray origins in a random order
+  """
+  origins = list(RAY_ORIGINS)
+  rng.shuffle(origins)
+  return BlackBoxGame(rng.sample(INNER_CELLS, atom_count)), origins
+
+
+def _next_move(rng, origins, shot_ratio):
+  """Picks a shot from an origin not used yet or a random guess
+
+  Returns:
+      tuple: (operation, row, col)
+  """
+  if origins and rng.random() < shot_ratio:
+    return ('shoot_ray',) + origins.pop()
+  return ('guess_atom',) + rng.choice(INNER_CELLS)
+
+
+def _step(rng, game, origins, shot_ratio, atom_count, histograms):
+  """Makes and times the next move, starting a new game once the current one is over
+
+  Returns:
+      tuple: (the game played, its unused ray origins)
+  """
+  if game is None or game.get_score() < 5 or game.atoms_left() == 0:
+    game, origins = _new_game(rng, atom_count)
+  operation, row, col = _next_move(rng, origins, shot_ratio)
+  method = getattr(game, operation)
+  started = time.perf_counter_ns()
+  method(row, col)
+  histograms[operation].record(time.perf_counter_ns() - started)
+  return game, origins
+
+
+def _play(seed, deadline, shot_ratio, atom_count, think_time):
+  """Plays games until the deadline, timing every move
+
+  Returns:
+      dict: operation -> LatencyHistogram
+  """
+  rng = random.Random(seed)
+  histograms = {operation: LatencyHistogram() for operation in OPERATIONS}
+  game = origins = None
+  while time.perf_counter() < deadline:
+    game, origins = _step(rng, game, origins, shot_ratio, atom_count, histograms)
+    if think_time:
+      time.sleep(think_time)
+  return histograms
+
+
+async def _play_async(seed, deadline, shot_ratio, atom_count, think_time):
+  """Plays games like _play, yielding to the other players after every move
+
+  Returns:
+      dict: operation -> LatencyHistogram
+  """
+  rng = random.Random(seed)
+  histograms = {operation: LatencyHistogram() for operation in OPERATIONS}
+  game = origins = None
+  while time.perf_counter() < deadline:
+    game, origins = _step(rng, game, origins, shot_ratio, atom_count, histograms)
+    await asyncio.sleep(think_time)
+  return histograms
+
+
+def _play_process(arguments):
+  """Process entry point: plays until the deadline while a thread samples the process's resident set
+
+  Returns:
+      tuple: (operation -> LatencyHistogram, [(seconds since the run started, bytes)])
+  """
+  seed, epoch, deadline, shot_ratio, atom_count, think_time, sample_interval = arguments
+  samples = [(time.time() - epoch, _resident_bytes())]
+  stop = threading.Event()
+  def sample():
+    while not stop.wait(sample_interval):
+      samples.append((time.time() - epoch, _resident_bytes()))
+  sampler = threading.Thread(target=sample, daemon=True)
+  sampler.start()
+  histograms = _play(seed, time.perf_counter() + deadline - time.time(), shot_ratio, atom_count, think_time)
+  stop.set()
+  sampler.join()
+  samples.append((time.time() - epoch, _resident_bytes()))
+  return histograms, samples
+
+
+def _merge(results):
+  """Merges the per player histograms
+
+  Returns:
+      dict: operation -> LatencyHistogram
+  """
+  merged = {operation: LatencyHistogram() for operation in OPERATIONS}
+  for histograms in results:
+    for operation, histogram in histograms.items():
+      merged[operation].merge(histogram)
+  return merged
+
+
+def _merge_samples(series, interval):
+  """Sums the per process memory samples by elapsed time. Samples taken within the same interval are merged
+  into one, each process counting with its latest sample so far, or its first before it started sampling.
+
+  Args:
+      series (list): [(elapsed seconds, bytes)] per process
+      interval (float): seconds between samples
+
+  Returns:
+      list: (elapsed seconds, bytes) samples
+  """
+  latest = [samples[0][1] for samples in series]
+  merged = []
+  tick = None
+  for elapsed, index, resident in sorted((elapsed, index, resident) for index, samples in enumerate(series)
+                                         for elapsed, resident in samples):
+    latest[index] = resident
+    if merged and round(elapsed / interval) == tick:
+      merged[-1] = (elapsed, sum(latest))
+    else:
+      merged.append((elapsed, sum(latest)))
+    tick = round(elapsed / interval)
+  return merged
+
+
+def _resident_bytes():
+  """Gets the current resident set size, the peak on platforms without /proc
+
+  Returns:
+      int: bytes
+  """
+  try:
+    with open('/proc/self/statm') as statm:
+      return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+  except (OSError, ValueError):
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def main():
+  """Command line entry point: runs a load test and prints the report
+  """
+  parser = argparse.ArgumentParser(description='Soak test shoot_ray and guess_atom under concurrent players.')
+  parser.add_argument('--players', type=int, default=8)
+  parser.add_argument('--mode', choices=MODES, default='threads')
+  parser.add_argument('--duration', type=float, default=10)
+  parser.add_argument('--shot-ratio', type=float, default=0.8)
+  parser.add_argument('--atoms', type=int, default=4)
+  parser.add_argument('--think-time', type=float, default=0)
+  parser.add_argument('--sample-interval', type=float, default=1)
+  parser.add_argument('--seed', type=int)
+  args = parser.parse_args()
+
+  report = LoadGenerator(args.players, args.mode, args.duration, args.shot_ratio, args.atoms, args.think_time,
+                         args.sample_interval, args.seed).run()
+  print(f"{report['players']} players ({report['mode']}) for {report['duration']:.1f}s")
+  print(f"{'operation':<12}{'count':>10}{'ops/s':>12}{'mean us':>10}{'p50 us':>10}{'p99 us':>10}{'p999 us':>10}{'max us':>10}")
+  for operation, stats in report['operations'].items():
+    print(f"{operation:<12}{stats['count']:>10}{stats['throughput']:>12.0f}{stats['mean_us']:>10.1f}{stats['p50_us']:>10.1f}"
+          f"{stats['p99_us']:>10.1f}{stats['p999_us']:>10.1f}{stats['max_us']:>10.1f}")
+  memory = report['memory']
+  print(f"memory: {memory['start_bytes'] / 2 ** 20:.1f} MiB -> {memory['end_bytes'] / 2 ** 20:.1f} MiB "
+        f"({memory['growth_bytes'] / 2 ** 20:+.1f} MiB)")
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,511 @@
+import heapq
+import math
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from Board import Board
+from LaserController import LaserController
+
+GUESS_ACTIONS = 8 # guesses searched per node, the likeliest cells
+
+
+class MCTSPlayer:
+  """MCTSPlayer class plays a BlackBoxGame to maximise the final score using Monte Carlo tree search
+  over shot and guess actions. Rollouts are played against atom layouts sampled from a particle set
+  that is kept consistent with the shots and guesses observed so far. The search tree is kept between
+  moves so the subtree below the observed outcome is reused. Worker processes search their own trees from the
+  same position and their statistics are added up.
+  """
+  def __init__(self, game, atom_count=None, time_budget=0.25, workers=0, particles=200, exploration=1.0, seed=None):
+    """
+    Args:
+        game (BlackBoxGame): a fresh game for the player to play, on a board of any size
+        atom_count (int, optional): number of atoms hidden on the board. Defaults to game.atoms_left().
+        time_budget (float, optional): seconds per move, refreshing the particles takes at most half of it. Defaults to 0.25.
+        workers (int, optional): number of worker processes running rollouts, 0 searches in-process. Defaults to 0.
+        particles (int, optional): number of consistent atom layouts kept for sampling. Defaults to 200.
+        exploration (float, optional): UCT exploration constant. Defaults to 1.0.
+        seed (int, optional): seed for reproducible play when searching in-process. Defaults to None.
+    """
+    self._game = game
+    self._length = len(game.get_board())
+    self._atom_count = game.atoms_left() if atom_count is None else atom_count
+    self._time_budget = time_budget
+    self._workers = workers
+    self._particle_count = particles
+    self._exploration = exploration
+    self._rng = random.Random(seed)
+    self._executor = ProcessPoolExecutor(workers) if workers > 1 else None
+    self._shots = [] # [(origin, outcome)]
+    self._ports = set()
+    self._guesses = set()
+    self._known_atoms = set()
+    self._known_empty = set()
+    cells = _geometry(self._length)[0]
+    self._particles = [frozenset(self._rng.sample(cells, self._atom_count)) for _ in range(particles)]
+    for layout in self._particles: # traced up front like refreshed ones, so the first move gets its whole budget
+      _ray_outcomes(layout, game.get_rules(), self._length)
+    self._consistent = True # whether every particle agrees with every observation
+    self._root = _Node()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def close(self):
+    """Shuts down the worker pool if one was started
+    """
+    if self._executor is not None:
+      self._executor.shutdown()
+      self._executor = None
+
+  def choose_action(self):
+    """Searches from the current position and returns the most visited action, the best on average among
+    equally visited ones
+
+    Returns:
+        (tuple | None): ('shoot', (row, col)) or ('guess', (row, col)), None if the game is over for the player
+    """
+    start = time.perf_counter()
+    deadline = start + self._time_budget
+    self._refresh_particles(start + self._time_budget / 2)
+    state = self._state()
+    beliefs = _Beliefs(self._particles, self._game.get_rules(), self._length)
+    context = (self._atom_count, self._exploration, self._game.get_rules())
+    self._root.actions = None # candidate guesses change with the particles
+    actions = _legal_actions(self._root, state, beliefs, beliefs.everything, self._atom_count)
+    if len(actions) < 2:
+      return actions[0] if actions else None
+
+    if self._executor is None:
+      _search((self._root, state, beliefs, context, deadline - time.perf_counter(), self._rng.randrange(2 ** 32)))
+    else: # workers grow fresh trees rather than receiving the kept one, only their statistics are added
+      time_budget = deadline - time.perf_counter()
+      payloads = [(_Node(), state, beliefs, context, time_budget, self._rng.randrange(2 ** 32))
+                  for _ in range(self._workers)]
+      for result in self._executor.map(_search, payloads):
+        _merge(self._root, result)
+
+    def rank(action):
+      visits, total = self._root.stats.get(action, (0, 0.0))
+      return (visits, total / visits if visits else -math.inf)
+    return max(self._root.actions, key=rank)
+
+  def play_move(self):
+    """Chooses an action and plays it on the game
+
+    Returns:
+        (tuple | None): (action, result) where result is what the game returned, None if the game is over for the player
+    """
+    action = self.choose_action()
+    if action is None:
+      return None
+    kind, (row, col) = action
+    if kind == 'shoot':
+      result = self._game.shoot_ray(row, col)
+      if isinstance(result, str): # not enough points
+        return action, result
+      self._shots.append(((row, col), result))
+      self._ports.add((row, col))
+      if result:
+        self._ports.add(result)
+    else:
+      result = self._game.guess_atom(row, col)
+      if isinstance(result, str): # not enough points
+        return action, result
+      self._guesses.add((row, col))
+      (self._known_atoms if result else self._known_empty).add((row, col))
+    # particles already agree with the earlier observations, only the new one needs checking
+    filtered = _filter(self._particles, action, result, self._game.get_rules(), self._length)
+    if filtered:
+      self._particles = filtered
+    else: # keep the old ones as starting points for repairs
+      self._consistent = False
+    self._root = self._root.children.get((action, result)) or _Node()
+    return action, result
+
+  def play(self):
+    """Plays moves until every atom is found or no action is affordable
+
+    Returns:
+        int: the final score of the game
+    """
+    while self.play_move():
+      pass
+    return self._game.get_score()
+
+  def _state(self):
+    """Builds the search state from what the player has observed of the game
+
+    Returns:
+        tuple: (points, ports, guesses, found)
+    """
+    found = self._atom_count - self._game.atoms_left()
+    return (self._game.get_score(), frozenset(self._ports), frozenset(self._guesses), found)
+
+  def _evidence(self):
+    """Returns the observations a sampled layout must agree with
+
+    Returns:
+        tuple: (shots, known atoms, known empty cells)
+    """
+    return (tuple(self._shots), frozenset(self._known_atoms), frozenset(self._known_empty))
+
+  def _refresh_particles(self, deadline):
+    """Replenishes the particle set with local moves from the particles agreeing with the evidence, repairing
+    contradicting layouts by local search if none do. Stops at the deadline with whatever was found, new
+    particles already traced from every origin.
+
+    Args:
+        deadline (float): time.perf_counter() value to stop at
+    """
+    evidence = self._evidence()
+    rules = self._game.get_rules()
+    survivors = list(self._particles) if self._consistent else []
+    attempts = 0
+    while len(survivors) < self._particle_count and attempts < 20 * self._particle_count:
+      if time.perf_counter() >= deadline:
+        break
+      attempts += 1
+      if survivors:
+        candidate = _propose(self._rng.choice(survivors), evidence, self._length, self._rng)
+        if _mismatches(candidate, evidence, rules, self._length) != 0:
+          continue
+      else:
+        candidate = _repair(self._rng.choice(self._particles), evidence, rules, self._length, self._rng,
+                            deadline=deadline)
+        if candidate is None:
+          continue
+      _ray_outcomes(candidate, rules, self._length) # traced here so indexing the beliefs for the search takes no search time
+      survivors.append(candidate)
+    if survivors:
+      self._particles = survivors
+      self._consistent = True
+
+
+class _Node:
+  """Search tree node. Statistics are kept per action, children are keyed by (action, outcome).
+  """
+  __slots__ = ('visits', 'stats', 'children', 'actions')
+
+  def __init__(self):
+    self.visits = 0
+    self.stats = {} # action -> [visits, total reward]
+    self.children = {}
+    self.actions = None
+
+
+class _Beliefs:
+  """Particle set indexed for the search. A subset of the particles is an int with a bit per particle, so
+  narrowing beliefs down to an outcome is an AND and weighing a cell a popcount, however deep the search.
+  """
+  __slots__ = ('particles', 'origins', 'origin_index', 'everything', 'outcomes', 'shots', 'cells')
+
+  def __init__(self, particles, rules, length):
+    """
+    Args:
+        particles (list): consistent atom layouts, each a frozenset of (row, col) tuples
+        rules (DeflectionRules): rules of the game variant
+        length (int): the length of a side of the board including ray origins
+    """
+    self.particles = particles
+    _, self.origins, self.origin_index = _geometry(length)
+    self.everything = (1 << len(particles)) - 1
+    self.outcomes = [_ray_outcomes(layout, rules, length) for layout in particles]
+    self.shots = [{} for _ in self.origins] # origin index -> outcome -> particles producing it
+    self.cells = {} # (row, col) -> particles holding an atom there
+    for index, layout in enumerate(particles):
+      bit = 1 << index
+      for origin, outcome in enumerate(self.outcomes[index]):
+        self.shots[origin][outcome] = self.shots[origin].get(outcome, 0) | bit
+      for cell in layout:
+        self.cells[cell] = self.cells.get(cell, 0) | bit
+
+  def narrow(self, subset, action, outcome):
+    """Keeps the particles that would have produced the outcome of an action
+
+    Returns:
+        int: the narrowed subset
+    """
+    kind, cell = action
+    if kind == 'shoot':
+      return subset & self.shots[self.origin_index[cell]].get(outcome, 0)
+    held = self.cells.get(cell, 0)
+    return subset & held if outcome else subset & ~held
+
+  def likeliest(self, subset, guesses, count):
+    """Gets the cells not guessed yet that most particles of a subset hold an atom in
+
+    Returns:
+        list: up to count (probability, (row, col)) tuples, likeliest first, only non-zero probabilities
+    """
+    total = subset.bit_count()
+    if total * len(self.particles[0]) < len(self.cells): # few particles, counting their atoms is quicker
+      counts = {}
+      while subset:
+        bit = subset & -subset
+        subset ^= bit
+        for cell in self.particles[bit.bit_length() - 1]:
+          counts[cell] = counts.get(cell, 0) + 1
+      weights = ((-weight, cell) for cell, weight in counts.items() if cell not in guesses)
+    else:
+      weights = ((-(held & subset).bit_count(), cell) for cell, held in self.cells.items() if cell not in guesses)
+    return [(-weight / total, cell) for weight, cell in heapq.nsmallest(count, weights) if weight]
+
+
+@lru_cache(maxsize=None)
+def _geometry(length):
+  """Gets the cells and ray origins of a board
+
+  Args:
+      length (int): the length of a side of the board including ray origins
+
+  Returns:
+      tuple: (inner cells, ray origins in Board.ray_origins order, origin -> index in that order)
+  """
+  cells = tuple((row, col) for row in range(1, length - 1) for col in range(1, length - 1))
+  origins = tuple(Board.ray_origins(length))
+  return cells, origins, {origin: index for index, origin in enumerate(origins)}
+
+
+@lru_cache(maxsize=65536)
+def _ray_outcome(layout, origin, rules, length):
+  """Traces a ray on a board built from a sampled layout
+
+  Args:
+      layout (frozenset): (row, col) tuples of atom locations
+      origin (tuple): (row, col) the ray is shot from
+      rules (DeflectionRules): rules of the game variant
+      length (int): the length of a side of the board including ray origins
+
+  Returns:
+      (tuple | None): the exit position, None for a hit
+  """
+  pos, _, hit, _ = LaserController(rules).trace(Board(length, layout).get_board(), origin[0], origin[1])
+  return None if hit else pos
+
+
+@lru_cache(maxsize=4096)
+def _ray_outcomes(layout, rules, length):
+  """Traces a ray from every origin on one board built from a sampled layout
+
+  Returns:
+      tuple: what _ray_outcome returns per origin in Board.ray_origins order
+  """
+  board = Board(length, layout).get_board()
+  laser = LaserController(rules)
+  outcomes = []
+  for row, col in _geometry(length)[1]:
+    pos, _, hit, _ = laser.trace(board, row, col)
+    outcomes.append(None if hit else pos)
+  return tuple(outcomes)
+
+
+def _mismatches(layout, evidence, rules, length):
+  """Counts the observations a layout contradicts
+
+  Args:
+      layout (frozenset): (row, col) tuples of atom locations
+      evidence (tuple): (shots, known atoms, known empty cells)
+      rules (DeflectionRules): rules of the game variant
+      length (int): the length of a side of the board including ray origins
+
+  Returns:
+      int: number of contradicted observations
+  """
+  shots, known_atoms, known_empty = evidence
+  count = len(known_atoms - layout) + len(known_empty & layout)
+  for origin, outcome in shots:
+    if _ray_outcome(layout, origin, rules, length) != outcome:
+      count += 1
+  return count
+
+
+def _propose(layout, evidence, length, rng):
+  """Moves one atom not known to be an atom to a random free cell not known to be empty
+
+  Returns:
+      frozenset: the new layout
+  """
+  _, known_atoms, known_empty = evidence
+  movable = [cell for cell in layout if cell not in known_atoms]
+  if not movable:
+    return layout
+  target = rng.choice(_geometry(length)[0])
+  if target in layout or target in known_empty:
+    return layout
+  return layout.difference([rng.choice(movable)]).union([target])
+
+
+def _repair(layout, evidence, rules, length, rng, max_steps=200, deadline=None):
+  """Local search that accepts moves not increasing the number of contradicted observations
+
+  Returns:
+      (frozenset | None): a consistent layout, None if none was reached within max_steps or by the deadline
+  """
+  mismatches = _mismatches(layout, evidence, rules, length)
+  for _ in range(max_steps):
+    if mismatches == 0:
+      return layout
+    if deadline is not None and time.perf_counter() >= deadline:
+      break
+    candidate = _propose(layout, evidence, length, rng)
+    candidate_mismatches = _mismatches(candidate, evidence, rules, length)
+    if candidate_mismatches <= mismatches:
+      layout, mismatches = candidate, candidate_mismatches
+  return layout if mismatches == 0 else None
+
+
+def _filter(particles, action, outcome, rules, length):
+  """Keeps the layouts that would have produced the outcome of an action
+  """
+  kind, cell = action
+  if kind == 'shoot':
+    return [layout for layout in particles if _ray_outcome(layout, cell, rules, length) == outcome]
+  return [layout for layout in particles if (cell in layout) == outcome]
+
+
+def _legal_actions(node, state, beliefs, subset, atom_count):
+  """Gets (and caches on the node) the actions worth playing from a state. A cell every particle of the subset
+  holds an atom in is guessed right away, as that guess is free. Shots need 3 points so the worst case cost of 2
+  stays below the points total. Guesses need 5 and are limited to the GUESS_ACTIONS likeliest cells, those
+  below even odds only once there is nothing left to shoot.
+  """
+  if node.actions is None:
+    points, ports, guesses, found = state
+    actions = []
+    if found < atom_count:
+      shots = [('shoot', origin) for origin in beliefs.origins if origin not in ports] if points >= 3 else []
+      likeliest = beliefs.likeliest(subset, guesses, GUESS_ACTIONS) if points >= 5 else []
+      if likeliest and likeliest[0][0] == 1:
+        actions.append(('guess', likeliest[0][1]))
+      else:
+        actions.extend(('guess', cell) for probability, cell in likeliest if probability >= 0.5 or not shots)
+        actions.extend(shots)
+    node.actions = actions
+  return node.actions
+
+
+def _apply(state, action, beliefs, index):
+  """Plays an action on a simulated state using the game's point rules
+
+  Args:
+      beliefs (_Beliefs): the indexed particles
+      index (int): the particle played against
+
+  Returns:
+      tuple: (new state, outcome) where outcome is what the game would return
+  """
+  points, ports, guesses, found = state
+  kind, cell = action
+  if kind == 'shoot':
+    outcome = beliefs.outcomes[index][beliefs.origin_index[cell]]
+    new_ports = {cell, outcome} - ports - {None}
+    return (points - len(new_ports), ports | new_ports, guesses, found), outcome
+  outcome = cell in beliefs.particles[index]
+  if outcome:
+    return (points, ports, guesses | {cell}, found + 1), outcome
+  return (points - 5, ports, guesses | {cell}, found), outcome
+
+
+def _reward(points, found, atom_count):
+  """Final score with every atom left unfound costing a wrong guess, scaled to the starting points
+  """
+  return (points - 5 * (atom_count - found)) / 25
+
+
+def _rollout(state, index, beliefs, subset, context, rng):
+  """Default policy: guesses the likeliest cell once it is at least even odds, otherwise shoots a random
+  unused origin and narrows the beliefs down, until all atoms are found or guesses are unaffordable.
+  """
+  atom_count = context[0]
+  while state[3] < atom_count and state[0] >= 5:
+    likeliest = beliefs.likeliest(subset, state[2], 1)
+    if not likeliest:
+      break
+    probability, cell = likeliest[0]
+    origins = [origin for origin in beliefs.origins if origin not in state[1]]
+    if probability >= 0.5 or not origins:
+      action = ('guess', cell)
+    else:
+      action = ('shoot', rng.choice(origins))
+    state, outcome = _apply(state, action, beliefs, index)
+    subset = beliefs.narrow(subset, action, outcome)
+  return _reward(state[0], state[3], atom_count)
+
+
+def _select(node, exploration):
+  """Picks the action maximising the UCT score
+  """
+  log_visits = math.log(node.visits)
+  def uct(action):
+    visits, total = node.stats[action]
+    return total / visits + exploration * math.sqrt(log_visits / visits)
+  return max(node.actions, key=uct)
+
+
+def _iterate(root, state, index, beliefs, context, rng):
+  """Runs one selection/expansion/rollout/backpropagation pass against a sampled particle. The beliefs are
+  narrowed down to the particles agreeing with every outcome on the way, the sampled one always among them.
+  """
+  atom_count, exploration, _ = context
+  subset = beliefs.everything
+  path = []
+  node = root
+  while True:
+    actions = _legal_actions(node, state, beliefs, subset, atom_count)
+    if not actions:
+      reward = _reward(state[0], state[3], atom_count)
+      break
+    untried = [action for action in actions if action not in node.stats]
+    action = rng.choice(untried) if untried else _select(node, exploration)
+    state, outcome = _apply(state, action, beliefs, index)
+    subset = beliefs.narrow(subset, action, outcome)
+    path.append((node, action))
+    node = node.children.setdefault((action, outcome), _Node())
+    if untried:
+      reward = _rollout(state, index, beliefs, subset, context, rng)
+      break
+
+  for parent, action in path:
+    parent.visits += 1
+    stat = parent.stats.setdefault(action, [0, 0.0])
+    stat[0] += 1
+    stat[1] += reward
+
+
+def _search(payload):
+  """Worker entry point: searches from a root until the time budget runs out
+
+  Args:
+      payload (tuple): (root, state, beliefs, context, time budget, seed)
+
+  Returns:
+      _Node: the searched root
+  """
+  root, state, beliefs, context, time_budget, seed = payload
+  rng = random.Random(seed)
+  deadline = time.perf_counter() + time_budget
+  count = len(beliefs.particles)
+  while True:
+    _iterate(root, state, rng.randrange(count), beliefs, context, rng)
+    if time.perf_counter() >= deadline:
+      return root
+
+
+def _merge(target, result):
+  """Adds the statistics of a tree a worker searched into target
+  """
+  target.visits += result.visits
+  for action, (visits, total) in result.stats.items():
+    stat = target.stats.setdefault(action, [0, 0.0])
+    stat[0] += visits
+    stat[1] += total
+  if target.actions is None:
+    target.actions = result.actions
+  for key, child in result.children.items():
+    _merge(target.children.setdefault(key, _Node()), child)
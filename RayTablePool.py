@@ -0,0 +1,420 @@
+import mmap
+import os
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+try:
+  import _posixshmem
+except ImportError: # Windows, where segments are not handed to a resource tracker
+  _posixshmem = None
+
+from Board import Board, HIT_CELL, ORIGIN_INDEX, RAY_ORIGINS, REFLECT
+from DeflectionRules import DEFAULT_RULES, DIRECTION_INDEX, DIRECTIONS
+from LaserController import LaserController
+
+# control segment: magic, published version, token of the publisher that owns the segment
+CONTROL = struct.Struct('<4sQQ')
+# data segment header: magic, format version, published version, layout count, fingerprint of the
+# deflection rules, followed by count sorted uint64 layout masks, count rows of 32 outcome bytes and count
+# uint64 words holding the direction each ray ends in, two bits per origin
+HEADER = struct.Struct('<4sIQQQ')
+FORMAT_VERSION = 4
+MAGIC = b'BBRT'
+
+_live = {} # control segment name -> tokens of the open publishers in this process sharing its registration
+
+
+class RayTablePublisher:
+  """RayTablePublisher class precomputes ray outcome tables for a set of atom layouts and publishes them to
+  shared memory for RayTablePool readers in any process on the host. Each publication goes to a fresh segment
+  and only then becomes current, so readers never see a half written table.
+  """
+  def __init__(self, name, rules=DEFAULT_RULES):
+    """
+    Args:
+        name (string): name of the control segment readers attach to
+        rules (DeflectionRules, optional): rules of the game variant the tables are computed for. Defaults to DEFAULT_RULES.
+    """
+    self._name = name
+    self._rules = rules
+    self._token = int.from_bytes(os.urandom(8), 'little')
+    try:
+      self._control = shared_memory.SharedMemory(name, create=True, size=CONTROL.size)
+      CONTROL.pack_into(self._control.buf, 0, MAGIC, 0, self._token)
+    except FileExistsError: # taking over from an earlier publisher, which leaves the segment to this one
+      self._control = shared_memory.SharedMemory(name) # tracked like a created one, this publisher may unlink it
+      CONTROL.pack_into(self._control.buf, 0, MAGIC, self.get_version(), self._token)
+    _live.setdefault(name, set()).add(self._token)
+    self._segment = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def get_version(self):
+    """Gets the currently published version
+
+    Returns:
+        int: the version, 0 if nothing was published yet
+    """
+    return CONTROL.unpack_from(self._control.buf)[1]
+
+  def publish(self, layouts):
+    """Computes the outcome tables of the layouts and publishes them as the next version
+
+    Args:
+        layouts (iterable): atom layouts, each an iterable of (row, col) tuples within the inner board
+
+    Returns:
+        int: the published version
+    """
+    tables = {}
+    for atom_locations in layouts:
+      atom_locations = list(atom_locations)
+      tables[Board.atom_mask(atom_locations)] = RayTablePublisher._compute(atom_locations, self._rules)
+
+    version = self.get_version() + 1
+    count = len(tables)
+    keys_offset = HEADER.size
+    tables_offset = keys_offset + 8 * count
+    directions_offset = tables_offset + 32 * count
+    name = f"{self._name}_{version}"
+    segment = shared_memory.SharedMemory(name, create=True, size=max(directions_offset + 8 * count, 1))
+    HEADER.pack_into(segment.buf, 0, MAGIC, FORMAT_VERSION, version, count, self._rules.get_fingerprint())
+    for index, key in enumerate(sorted(tables)):
+      table, directions = tables[key]
+      struct.pack_into('=Q', segment.buf, keys_offset + 8 * index, key)
+      segment.buf[tables_offset + 32 * index:tables_offset + 32 * (index + 1)] = table
+      struct.pack_into('=Q', segment.buf, directions_offset + 8 * index, directions)
+
+    CONTROL.pack_into(self._control.buf, 0, MAGIC, version, self._token) # readers switch over from here
+    self._release_segment()
+    self._segment = segment
+    return version
+
+  def close(self, unlink=True):
+    """Closes the segments, unlinking them by default so the memory is freed once readers detach. The control
+    segment is only unlinked if no other publisher has taken it over since.
+
+    Args:
+        unlink (bool, optional): whether to remove the segments from the host. Defaults to True.
+    """
+    self._release_segment(unlink)
+    if self._control is not None:
+      owned = CONTROL.unpack_from(self._control.buf)[2] == self._token
+      live = _live.get(self._name, set())
+      live.discard(self._token)
+      self._control.close()
+      if unlink and owned:
+        try:
+          self._control.unlink()
+        except FileNotFoundError:
+          pass
+        _live.pop(self._name, None)
+      elif self._name in _live and not live:
+        # the last publisher here, keep the resource tracker from unlinking the segment when this process exits
+        resource_tracker.unregister(self._control._name, 'shared_memory')
+        _live.pop(self._name)
+      self._control = None
+
+  def _release_segment(self, unlink=True):
+    """Closes (and unlinks) the previously published segment. Attached readers keep their mapping.
+    """
+    if self._segment is not None:
+      self._segment.close()
+      if unlink:
+        self._segment.unlink()
+      self._segment = None
+
+  @staticmethod
+  def compute_table(atom_locations, rules=DEFAULT_RULES):
+    """Computes the outcome of every ray origin for a layout
+
+    Args:
+        atom_locations (list): (row, col) tuples indicating atom locations
+        rules (DeflectionRules, optional): rules of the game variant. Defaults to DEFAULT_RULES.
+
+    Returns:
+        bytes: one byte per origin in Board.ray_origins order, the exit's origin index, HIT_CELL plus the index
+        of the atom hit or REFLECT
+    """
+    return RayTablePublisher._compute(atom_locations, rules)[0]
+
+  @staticmethod
+  def _compute(atom_locations, rules):
+    """Computes the outcome table of a layout along with the direction each ray ends in, which for a hit
+    depends on the path taken and so cannot be told from the outcome alone
+
+    Returns:
+        tuple: (outcome bytes as returned by compute_table, index in DIRECTIONS of the final direction packed
+        two bits per origin)
+    """
+    board = Board(10, atom_locations).get_board()
+    laser = LaserController(rules)
+    table = bytearray()
+    directions = 0
+    for index, (row, col) in enumerate(RAY_ORIGINS):
+      pos, direction, hit, trajectory = laser.trace(board, row, col)
+      if hit:
+        table.append(HIT_CELL + (pos[0] - 1) * 8 + pos[1] - 1)
+      elif not trajectory: # reflected at the border
+        table.append(REFLECT)
+      else:
+        table.append(ORIGIN_INDEX[pos])
+      directions |= DIRECTION_INDEX[direction] << 2 * index
+    return bytes(table), directions
+
+
+class RayTablePool:
+  """RayTablePool class attaches to tables published by a RayTablePublisher and reads ray outcomes straight
+  from shared memory. Call refresh to pick up a newer publication.
+  """
+  def __init__(self, name):
+    """
+    Args:
+        name (string): name of the publisher's control segment
+    """
+    self._name = name
+    self._control = _attach(name)
+    self._segment = None
+    self._keys = None
+    self._tables = None
+    self._directions = None
+    self._version = 0
+    self._fingerprint = None
+    self.refresh()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def __len__(self):
+    return len(self._keys) if self._keys is not None else 0
+
+  def __contains__(self, atom_mask):
+    return self._find(atom_mask) is not None
+
+  def get_version(self):
+    """Gets the version of the attached tables
+
+    Returns:
+        int: the version, 0 if nothing is attached
+    """
+    return self._version
+
+  def get_fingerprint(self):
+    """Gets the fingerprint of the deflection rules the attached tables were computed with
+
+    Returns:
+        (int | None): see DeflectionRules.get_fingerprint, None if nothing is attached
+    """
+    return self._fingerprint
+
+  def refresh(self, retries=5):
+    """Attaches to the currently published version if it differs from the attached one
+
+    Args:
+        retries (int, optional): attempts when a publication is replaced while attaching. Defaults to 5.
+
+    Returns:
+        bool: whether a new version was attached
+    """
+    for _ in range(retries):
+      version = CONTROL.unpack_from(self._control.buf)[1]
+      if version == self._version or version == 0:
+        return False
+      try:
+        segment = _attach(f"{self._name}_{version}")
+      except FileNotFoundError: # re-published in between, read the control segment again
+        time.sleep(0.001)
+        continue
+      magic, format_version, segment_version, count, fingerprint = HEADER.unpack_from(segment.buf)
+      if magic != MAGIC or format_version != FORMAT_VERSION or segment_version != version:
+        segment.close()
+        raise ValueError(f"Segment {self._name}_{version} does not hold version {version} ray tables")
+      self._release()
+      self._segment = segment
+      self._keys = segment.buf[HEADER.size:HEADER.size + 8 * count].cast('Q')
+      self._tables = segment.buf[HEADER.size + 8 * count:HEADER.size + 40 * count]
+      self._directions = segment.buf[HEADER.size + 40 * count:HEADER.size + 48 * count].cast('Q')
+      self._version = version
+      self._fingerprint = fingerprint
+      return True
+    return False
+
+  def get_table(self, atom_mask):
+    """Gets the outcome table of a layout without copying it. Release the view before closing the pool.
+
+    Args:
+        atom_mask (int): the layout as built by Board.atom_mask
+
+    Returns:
+        (memoryview | None): 32 outcome bytes in Board.ray_origins order, None if the layout is not published
+    """
+    index = self._find(atom_mask)
+    if index is None:
+      return None
+    return self._tables[32 * index:32 * (index + 1)]
+
+  def get_outcome(self, atom_mask, row, col):
+    """Gets the outcome of a shot on a published layout
+
+    Args:
+        atom_mask (int): the layout as built by Board.atom_mask
+        row (int): the row from where the shot originates
+        col (int): the column from where the shot originates
+
+    Raises:
+        KeyError: if the layout is not published
+
+    Returns:
+        (tuple | string | None): the exit position, 'reflect' for a reflection at the border or None for a hit
+    """
+    code = self._code(atom_mask, row, col)
+    if code == REFLECT:
+      return 'reflect'
+    if code >= HIT_CELL:
+      return None
+    return RAY_ORIGINS[code]
+
+  def get_hit_location(self, atom_mask, row, col):
+    """Gets the atom a shot on a published layout hits
+
+    Args:
+        atom_mask (int): the layout as built by Board.atom_mask
+        row (int): the row from where the shot originates
+        col (int): the column from where the shot originates
+
+    Raises:
+        KeyError: if the layout is not published
+
+    Returns:
+        (tuple | None): (row, col) of the atom hit, None if the ray does not hit one
+    """
+    code = self._code(atom_mask, row, col)
+    if code == REFLECT or code < HIT_CELL:
+      return None
+    return ((code - HIT_CELL) // 8 + 1, (code - HIT_CELL) % 8 + 1)
+
+  def get_direction(self, atom_mask, row, col):
+    """Gets the direction a shot on a published layout ends in, as it exits, hits or is reflected at the border
+
+    Args:
+        atom_mask (int): the layout as built by Board.atom_mask
+        row (int): the row from where the shot originates
+        col (int): the column from where the shot originates
+
+    Raises:
+        KeyError: if the layout is not published
+
+    Returns:
+        string: 'south' | 'north' | 'east' | 'west'
+    """
+    index = self._find(atom_mask)
+    if index is None:
+      raise KeyError(atom_mask)
+    return DIRECTIONS[self._directions[index] >> 2 * ORIGIN_INDEX[(row, col)] & 3]
+
+  def _code(self, atom_mask, row, col):
+    """Reads the stored outcome code of a shot
+
+    Raises:
+        KeyError: if the layout is not published
+    """
+    index = self._find(atom_mask)
+    if index is None:
+      raise KeyError(atom_mask)
+    return self._tables[32 * index + ORIGIN_INDEX[(row, col)]]
+
+  def close(self):
+    """Detaches from shared memory
+    """
+    self._release()
+    if self._control is not None:
+      self._control.close()
+      self._control = None
+
+  def _find(self, atom_mask):
+    """Binary searches the sorted layout masks
+
+    Returns:
+        (int | None): index of the layout, None if not published
+    """
+    keys = self._keys
+    if keys is None:
+      return None
+    low, high = 0, len(keys)
+    while low < high:
+      middle = (low + high) // 2
+      if keys[middle] < atom_mask:
+        low = middle + 1
+      else:
+        high = middle
+    if low < len(keys) and keys[low] == atom_mask:
+      return low
+    return None
+
+  def _release(self):
+    """Releases the views on the attached segment and detaches from it
+    """
+    if self._segment is not None:
+      self._keys.release()
+      self._tables.release()
+      self._directions.release()
+      self._segment.close()
+      self._segment = self._keys = self._tables = self._directions = None
+      self._version = 0
+      self._fingerprint = None
+
+
+class _Mapping:
+  """Read-only mapping of a shared memory segment that, unlike SharedMemory before Python 3.13, is never
+  registered with the resource tracker. Unregistering afterwards is no fix: child processes share their parent's
+  tracker, so that would drop the publisher's own registration.
+  """
+  def __init__(self, name):
+    """
+    Args:
+        name (string): the segment name
+
+    Raises:
+        FileNotFoundError: if there is no such segment
+    """
+    fd = _posixshmem.shm_open('/' + name, os.O_RDONLY, mode=0o600)
+    try:
+      self._mmap = mmap.mmap(fd, os.fstat(fd).st_size, access=mmap.ACCESS_READ)
+    finally:
+      os.close(fd)
+    self.buf = memoryview(self._mmap)
+
+  def close(self):
+    """Unmaps the segment
+    """
+    self.buf.release()
+    self._mmap.close()
+
+
+def _attach(name):
+  """Attaches to an existing segment without handing it to the resource tracker, which would otherwise
+  unlink it when the attaching process exits.
+
+  Args:
+      name (string): the segment name
+
+  Raises:
+      FileNotFoundError: if there is no such segment
+
+  Returns:
+      (SharedMemory | _Mapping): the attached segment, exposing buf and close
+  """
+  try:
+    return shared_memory.SharedMemory(name, track=False) # Python 3.13+
+  except TypeError:
+    if _posixshmem is None:
+      return shared_memory.SharedMemory(name)
+    return _Mapping(name)
@@ -0,0 +1,181 @@
+import json
+
+from Trajectory import Trajectory
+
+
+class SpectatorStream:
+  """SpectatorStream class sends spectators what changed on a game's board instead of re-rendering it: the
+  trajectory positions added and removed, new guesses and the score change since the last frame. A
+  keyframe with the whole view is sent every keyframe_interval frames and to every new subscriber, so
+  clients joining late or missing a frame catch up. Each frame is encoded once and the same bytes go to
+  every subscriber.
+
+  Frames are compact JSON objects:
+  - keyframe: {"n": sequence, "k": 1, "t": trajectory segments, "g": [[row, col, correct]], "s": score}
+  - delta: {"n": sequence, "t+": [[row, col]], "t-": [[row, col]], "g": [[row, col, correct]], "s": score change}
+  Keys of a delta that did not change are left out.
+  """
+  def __init__(self, game, keyframe_interval=30):
+    """
+    Args:
+        game (BlackBoxGame): the game being watched
+        keyframe_interval (int, optional): frames between keyframes. Defaults to 30.
+    """
+    self._game = game
+    self._keyframe_interval = keyframe_interval
+    self._subscribers = []
+    self._sequence = 0
+    self._since_keyframe = 0
+    self._view = self._capture()
+
+  def subscribe(self, send):
+    """Adds a subscriber and sends it a keyframe of the last frame's view
+
+    Args:
+        send (callable): called with the bytes of every frame
+    """
+    self._subscribers.append(send)
+    send(self._encode(SpectatorStream._keyframe(self._sequence, self._view)))
+
+  def unsubscribe(self, send):
+    """Removes a subscriber
+
+    Args:
+        send (callable): the callable passed to subscribe
+    """
+    self._subscribers.remove(send)
+
+  def publish(self):
+    """Sends subscribers the changes since the last frame, call after every shot or guess. Nothing is sent
+    when nothing changed, unless a keyframe is due.
+
+    Returns:
+        (bytes | None): the frame sent, None if none was
+    """
+    view = self._capture()
+    if self._since_keyframe + 1 >= self._keyframe_interval:
+      frame = SpectatorStream._keyframe(self._sequence + 1, view)
+      self._since_keyframe = 0
+    else:
+      frame = SpectatorStream._delta(self._sequence + 1, self._view, view)
+      if len(frame) == 1:
+        return None
+      self._since_keyframe += 1
+    self._sequence += 1
+    self._view = view
+
+    data = self._encode(frame)
+    for send in self._subscribers:
+      send(data)
+    return data
+
+  def _capture(self):
+    """Captures what spectators see of the game
+
+    Returns:
+        tuple: (trajectory segments, set of trajectory positions, guesses, score)
+    """
+    trajectory = self._game.get_trajectory()
+    return (trajectory.get_segments(), set(trajectory), self._game.get_guesses(), self._game.get_score())
+
+  @staticmethod
+  def _keyframe(sequence, view):
+    """Builds a frame holding the whole view
+
+    Returns:
+        dict: the keyframe
+    """
+    segments, _, guesses, score = view
+    return {
+      'n': sequence,
+      'k': 1,
+      't': [[list(start), direction, length] for start, direction, length in segments],
+      'g': sorted([row, col, int(correct)] for (row, col), correct in guesses.items()),
+      's': score,
+    }
+
+  @staticmethod
+  def _delta(sequence, previous, view):
+    """Builds a frame holding the changes between two views
+
+    Returns:
+        dict: the delta, only the sequence number if nothing changed
+    """
+    _, previous_trajectory, previous_guesses, previous_score = previous
+    _, trajectory, guesses, score = view
+    frame = {'n': sequence}
+    added = trajectory - previous_trajectory
+    removed = previous_trajectory - trajectory
+    new_guesses = [[row, col, int(correct)] for (row, col), correct in guesses.items() if (row, col) not in previous_guesses]
+    if added:
+      frame['t+'] = sorted([row, col] for row, col in added)
+    if removed:
+      frame['t-'] = sorted([row, col] for row, col in removed)
+    if new_guesses:
+      frame['g'] = sorted(new_guesses)
+    if score != previous_score:
+      frame['s'] = score - previous_score
+    return frame
+
+  @staticmethod
+  def _encode(frame):
+    return json.dumps(frame, separators=(',', ':')).encode()
+
+
+class SpectatorView:
+  """SpectatorView class rebuilds a spectator's view of the board from the frames of a SpectatorStream
+  """
+  def __init__(self):
+    self._sequence = None
+    self._trajectory = set()
+    self._guesses = {}
+    self._score = None
+
+  def apply(self, data):
+    """Applies a frame. Deltas are ignored until a keyframe arrives and after a missed frame until the next one.
+
+    Args:
+        data (bytes): the frame as sent by SpectatorStream
+
+    Returns:
+        boolean: whether the frame was applied
+    """
+    frame = json.loads(data)
+    if frame.get('k'):
+      self._trajectory = set(Trajectory((start, direction, length) for start, direction, length in frame['t']))
+      self._guesses = {(row, col): bool(correct) for row, col, correct in frame['g']}
+      self._score = frame['s']
+    elif self._sequence is None or frame['n'] != self._sequence + 1:
+      self._sequence = None # out of step, wait for the next keyframe
+      return False
+    else:
+      self._trajectory.difference_update((row, col) for row, col in frame.get('t-', ()))
+      self._trajectory.update((row, col) for row, col in frame.get('t+', ()))
+      self._guesses.update(((row, col), bool(correct)) for row, col, correct in frame.get('g', ()))
+      self._score += frame.get('s', 0)
+    self._sequence = frame['n']
+    return True
+
+  def get_trajectory(self):
+    """Gets the positions of the last ray
+
+    Returns:
+        set: (row, col) positions
+    """
+    return self._trajectory
+
+  def get_guesses(self):
+    """Gets the guesses made
+
+    Returns:
+        dict: (row, col) of each guess mapped to whether it was correct
+    """
+    return self._guesses
+
+  def get_score(self):
+    """Gets the score
+
+    Returns:
+        (int | None): the score, None before the first keyframe
+    """
+    return self._score
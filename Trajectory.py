@@ -0,0 +1,108 @@
+from DeflectionRules import STEPS
+
+DIRECTION_OF_STEP = {step: direction for direction, step in STEPS.items()}
+
+
+class Trajectory:
+  """Trajectory class stores the positions a ray travelled through as an ordered list of straight segments
+  [start, direction, length] instead of one tuple per position, so long paths stay small in memory and in
+  replay logs or network payloads. It keeps the set's add, clear and in, but unlike a set, len and
+  iteration count a position once per visit, in travel order. Like a set it is mutable and so unhashable.
+  """
+  __hash__ = None # mutable, like the set it replaces
+
+  def __init__(self, segments=()):
+    """
+    Args:
+        segments (iterable, optional): (start, direction, length) segments as returned by get_segments. Defaults to ().
+    """
+    self._segments = [[tuple(start), direction, length] for start, direction, length in segments]
+
+  def __contains__(self, coord):
+    for segment in self._segments:
+      if Trajectory._on_segment(segment, coord):
+        return True
+    return False
+
+  def __iter__(self):
+    """Yields every position in travel order, once per visit
+    """
+    for (row, col), direction, length in self._segments:
+      row_step, col_step = STEPS.get(direction, (0, 0))
+      for offset in range(length):
+        yield (row + offset * row_step, col + offset * col_step)
+
+  def __len__(self):
+    """Counts the positions visited, a position the ray crosses twice counting twice
+    """
+    return sum(length for _, _, length in self._segments)
+
+  def __eq__(self, other):
+    return isinstance(other, Trajectory) and self.get_segments() == other.get_segments()
+
+  def add(self, coord):
+    """Appends a position, extending the last segment when it continues straight on. Adding the position
+    the ray is already at does nothing.
+
+    Args:
+        coord (tuple): (row, col) of the position
+    """
+    coord = tuple(coord)
+    if self._segments:
+      last = self._segments[-1]
+      (row, col), direction, length = last
+      row_step, col_step = STEPS.get(direction, (0, 0))
+      end = (row + (length - 1) * row_step, col + (length - 1) * col_step)
+      if coord == end:
+        return
+      step = DIRECTION_OF_STEP.get((coord[0] - end[0], coord[1] - end[1]))
+      if step is not None and (direction == step or length == 1):
+        last[1] = step
+        last[2] += 1
+        return
+      if step is not None: # turned, the new segment heads off in the direction of this step
+        self._segments.append([coord, step, 1])
+        return
+    self._segments.append([coord, None, 1])
+
+  def clear(self):
+    """Removes every segment
+    """
+    self._segments.clear()
+
+  def get_segments(self):
+    """Gets the compact form of the trajectory
+
+    Returns:
+        list: (start, direction, length) tuples where start is (row, col), direction is 'south' | 'north' |
+        'east' | 'west' (None for a lone position) and length counts the positions in the segment
+    """
+    return [(start, direction, length) for start, direction, length in self._segments]
+
+  def rasterise(self, length):
+    """Draws the trajectory onto a grid
+
+    Args:
+        length (int): the length of a side of the board including ray origins
+
+    Returns:
+        list: length x length rows of booleans, True where the ray passed
+    """
+    grid = [[False] * length for _ in range(length)]
+    for row, col in self:
+      grid[row][col] = True
+    return grid
+
+  @staticmethod
+  def _on_segment(segment, coord):
+    """Checks whether a position lies on a segment
+
+    Returns:
+        boolean: whether the position is on the segment
+    """
+    (row, col), direction, length = segment
+    row_step, col_step = STEPS.get(direction, (0, 0))
+    row_delta = coord[0] - row
+    col_delta = coord[1] - col
+    offset = row_delta * row_step + col_delta * col_step # steps are unit vectors along one axis
+    return 0 <= offset < length and row_delta == offset * row_step and col_delta == offset * col_step
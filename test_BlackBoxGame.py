@@ -1,8 +1,27 @@
+import os
+import queue
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 
-from Board import Board
+from Board import Board, HIT_CELL, REFLECT
 from LaserController import LaserController
+from LayoutStore import LayoutStore, LayoutStoreWriter
+from AtomHeatmap import AtomHeatmap
 from BlackBoxGame import BlackBoxGame
+from BulkScorer import BulkScorer, ScoringEvents
+from DeflectionRules import DeflectionRules, DOUBLE_DEFLECTION_PASS, NO_EDGE_REFLECTION
+from LoadGenerator import LatencyHistogram, LoadGenerator
+from MCTSPlayer import MCTSPlayer
+from RayTablePool import RayTablePool, RayTablePublisher
+from SQLiteEventSink import SQLiteEventSink
+from SpectatorStream import SpectatorStream, SpectatorView
+from Trajectory import Trajectory
 
 class BlackBoxGameTest(unittest.TestCase):
   """Unit tests for BlackBoxGame class
@@ -45,6 +64,16 @@ class BlackBoxGameTest(unittest.TestCase):
     self.assertNotIn(True, invalid_inner_test_results)
     self.assertNotIn(True, invalid_boundaries_results)
 
+  def test_board_unchanged_by_callers(self):
+    """Tests changing the board returned by get_board does not move the game's atoms"""
+    game = BlackBoxGame([(4,4)])
+    board = game.get_board()
+
+    with self.assertRaises(TypeError):
+      board[4][4] = ''
+    board[4] = ('',) * 10
+    self.assertIsNone(game.shoot_ray(0,4))
+
   def test_direct_hit(self):
     """Test a direct hit from all directions
     """    
@@ -306,5 +335,683 @@ class BlackBoxGameTest(unittest.TestCase):
     self.assertEqual(message, "Not enough points to shoot from (8, 0)!")
 
 
+class DeflectionRulesTest(unittest.TestCase):
+  """Unit tests for DeflectionRules class
+  """
+  def test_standard_lookup(self):
+    """Tests the compiled standard rules turn away from a single atom, reverse between two and run into one ahead"""
+    rules = DeflectionRules()
+
+    self.assertEqual(rules.compute_direction('north', 'o', '', ''), 'east')
+    self.assertEqual(rules.compute_direction('south', 'o', '', None), 'west')
+    self.assertEqual(rules.compute_direction('east', '', '', 'o'), 'north')
+    self.assertEqual(rules.compute_direction('west', 'o', '', 'o'), 'east')
+    self.assertEqual(rules.compute_direction('west', 'o', 'o', 'o'), 'west')
+    self.assertTrue(rules.check_reflection('south', None, '', 'o'))
+    self.assertFalse(rules.check_reflection('south', 'o', 'o', ''))
+
+  def test_variants(self):
+    """Tests games played with variant rule sets"""
+    standard = BlackBoxGame([(1,5)])
+    no_edge_reflection = BlackBoxGame([(1,5)], rules=DeflectionRules(NO_EDGE_REFLECTION))
+    double_deflection = BlackBoxGame([(6,4), (6,6)], rules=DeflectionRules(DOUBLE_DEFLECTION_PASS))
+
+    self.assertEqual(standard.shoot_ray(0, 4), (0, 4))
+    self.assertEqual(no_edge_reflection.shoot_ray(0, 4), (9, 4))
+    self.assertEqual(double_deflection.shoot_ray(0, 5), (9, 5))
+    self.assertEqual(no_edge_reflection.get_rules().get_name(), 'no_edge_reflection')
+
+  def test_invalid_rules(self):
+    """Tests malformed rule sets are rejected"""
+    with self.assertRaises(ValueError):
+      DeflectionRules({'name': 'bad', 'inner': [(('o', '*', '*'), 'reflect')], 'edge': []})
+    with self.assertRaises(ValueError):
+      DeflectionRules({'name': 'bad', 'inner': [(('x', '*', '*'), 'pass')], 'edge': []})
+
+
+class MCTSPlayerTest(unittest.TestCase):
+  """Unit tests for MCTSPlayer class
+  """
+  def test_plays_to_completion(self):
+    """Tests the player finds a single atom and reports the game's final score"""
+    game = BlackBoxGame([(3,4)])
+    player = MCTSPlayer(game, time_budget=0.05, seed=1)
+
+    score = player.play()
+
+    self.assertEqual(game.atoms_left(), 0)
+    self.assertEqual(score, game.get_score())
+    self.assertGreater(score, 0)
+
+  def test_plays_larger_board(self):
+    """Tests the player shoots from the origins of a larger board and finds an atom outside the 8x8 corner"""
+    game = BlackBoxGame([(9,10)], side_length=10)
+    player = MCTSPlayer(game, time_budget=0.05, seed=1)
+
+    while True:
+      move = player.play_move()
+      if move is None:
+        break
+      self.assertIsNot(move[1], False)
+
+    self.assertEqual(game.atoms_left(), 0)
+
+  def test_worker_pool(self):
+    """Tests a move searched by a worker pool is legal and played on the game"""
+    game = BlackBoxGame([(2,6), (3,3), (7,6)])
+
+    with MCTSPlayer(game, time_budget=0.05, workers=2, seed=1) as player:
+      action, result = player.play_move()
+
+    self.assertIn(action[0], ('shoot', 'guess'))
+    self.assertNotIsInstance(result, str)
+
+  LAYOUTS = [[(1,6), (7,2), (7,6)], [(5,2), (7,4), (8,7)], [(5,7), (6,6), (8,6)], [(3,2), (4,4), (5,5)]]
+
+  def _play(self, workers):
+    """Plays every layout, returning the final scores and the number of atoms left unfound"""
+    scores = []
+    atoms_left = 0
+    for seed, layout in enumerate(self.LAYOUTS):
+      game = BlackBoxGame(layout)
+      with MCTSPlayer(game, time_budget=0.05, workers=workers, seed=seed) as player:
+        scores.append(player.play())
+      atoms_left += game.atoms_left()
+    return scores, atoms_left
+
+  def test_plays_well(self):
+    """Tests searched moves score well, where playing actions in list order shoots until guesses are unaffordable"""
+    scores, atoms_left = self._play(0)
+
+    self.assertLessEqual(atoms_left, 2)
+    self.assertGreaterEqual(sum(scores) / len(scores), 10)
+
+  def test_worker_pool_plays_as_well(self):
+    """Tests a worker pool plays about as well as searching in-process, with workers sharing a single CPU too"""
+    scores, atoms_left = self._play(2)
+
+    self.assertLessEqual(atoms_left, 3) # handing beliefs to the workers leaves less of each move's budget to search
+    self.assertGreaterEqual(sum(scores) / len(scores), 10)
+
+  def test_move_time_bounded(self):
+    """Tests moves keep to the time budget once shots have narrowed the layouts down"""
+    game = BlackBoxGame([(3,2), (2,1), (5,1), (2,8)])
+    player = MCTSPlayer(game, time_budget=0.1, seed=0)
+
+    for _ in range(12):
+      start = time.perf_counter()
+      if player.play_move() is None:
+        break
+      self.assertLess(time.perf_counter() - start, 0.5)
+
+
+def read_outcome(name, layout, row, col):
+  """Reads a published outcome, for running in a child process"""
+  with RayTablePool(name) as pool:
+    return pool.get_outcome(Board.atom_mask(layout), row, col)
+
+
+class RayTablePoolTest(unittest.TestCase):
+  """Unit tests for RayTablePublisher and RayTablePool classes
+  """
+  def test_shots_match_traversal(self):
+    """Tests a game reading published outcomes scores and returns the same as one traversing the board"""
+    layout = [(3,2), (3,7), (6,4), (8, 7)]
+    name = f"bbrt_test_{os.getpid()}"
+
+    with RayTablePublisher(name) as publisher:
+      publisher.publish([layout, [(4,4)]])
+      with RayTablePool(name) as pool:
+        traversed = BlackBoxGame(layout)
+        looked_up = BlackBoxGame(layout, ray_table=pool)
+        for origin in Board.ray_origins(10):
+          self.assertEqual(looked_up.shoot_ray(*origin), traversed.shoot_ray(*origin))
+          self.assertEqual(looked_up.get_score(), traversed.get_score())
+          self.assertEqual(looked_up.get_current_pos(), traversed.get_current_pos())
+          self.assertEqual(looked_up.get_current_direction(), traversed.get_current_direction())
+        self.assertEqual(len(pool), 2)
+        self.assertEqual(pool.get_direction(Board.atom_mask([(4,4)]), 0, 3), 'west')
+
+  def test_republication(self):
+    """Tests readers pick up a new version only when refreshed"""
+    name = f"bbrt_test_{os.getpid()}"
+
+    with RayTablePublisher(name) as publisher:
+      publisher.publish([[(4,4)]])
+      with RayTablePool(name) as pool:
+        publisher.publish([[(4,4)], [(2,6)], [(1,5)]])
+
+        self.assertEqual(pool.get_version(), 1)
+        self.assertNotIn(Board.atom_mask([(2,6)]), pool)
+        self.assertTrue(pool.refresh())
+        self.assertEqual(pool.get_version(), 2)
+        self.assertIsNone(pool.get_outcome(Board.atom_mask([(2,6)]), 0, 6))
+        self.assertEqual(pool.get_outcome(Board.atom_mask([(4,4)]), 0, 3), (3, 0))
+        self.assertEqual(pool.get_outcome(Board.atom_mask([(1,5)]), 0, 4), 'reflect')
+
+  def test_takeover(self):
+    """Tests a publisher taking over a name keeps serving it when the earlier publisher closes, in either order"""
+    name = f"bbrt_test_{os.getpid()}"
+
+    first = RayTablePublisher(name)
+    first.publish([[(4,4)]])
+    second = RayTablePublisher(name)
+    second.publish([[(2,6)]])
+    first.close()
+    with RayTablePool(name) as pool:
+      self.assertEqual(pool.get_version(), 2)
+      self.assertIn(Board.atom_mask([(2,6)]), pool)
+    second.close()
+    with self.assertRaises(FileNotFoundError):
+      RayTablePool(name)
+
+    first = RayTablePublisher(name)
+    second = RayTablePublisher(name)
+    second.close()
+    first.close()
+
+  def test_reader_in_child_process(self):
+    """Tests a reader in a spawned child leaves the publisher's segments to the publisher, which unlinks them
+    without resource tracker errors"""
+    script = f"""if True:
+      import multiprocessing, os
+      from RayTablePool import RayTablePublisher
+      from test_BlackBoxGame import read_outcome
+      if __name__ == '__main__':
+        name = 'bbrt_child_{os.getpid()}'
+        with RayTablePublisher(name) as publisher:
+          publisher.publish([[(4,4)]])
+          with multiprocessing.get_context('spawn').Pool(1) as pool:
+            print(pool.apply(read_outcome, (name, [(4,4)], 0, 3)))
+          publisher.publish([[(5,5)]])
+        print(os.path.exists('/dev/shm/' + name))
+    """
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    self.assertEqual(result.stdout.split(), ['(3,', '0)', 'False'])
+    self.assertEqual(result.stderr, '')
+
+  def test_rules_mismatch(self):
+    """Tests a game of another variant traverses the board instead of reading tables computed with other rules"""
+    name = f"bbrt_test_{os.getpid()}"
+    rules = DeflectionRules(NO_EDGE_REFLECTION)
+
+    with RayTablePublisher(name) as publisher:
+      publisher.publish([[(1,5)]])
+      with RayTablePool(name) as pool:
+        self.assertEqual(pool.get_fingerprint(), DeflectionRules().get_fingerprint())
+        self.assertNotEqual(pool.get_fingerprint(), rules.get_fingerprint())
+        self.assertEqual(BlackBoxGame([(1,5)], ray_table=pool).shoot_ray(0, 4), (0, 4))
+        self.assertEqual(BlackBoxGame([(1,5)], ray_table=pool, rules=rules).shoot_ray(0, 4), (9, 4))
+
+
+class AtomHeatmapTest(unittest.TestCase):
+  """Unit tests for AtomHeatmap class
+  """
+  def _observe(self, game, heatmap, origins):
+    """Shoots from the origins, records the outcomes and updates the heatmap"""
+    for row, col in origins:
+      heatmap.observe_shot(row, col, game.shoot_ray(row, col))
+    return heatmap.update()
+
+  def test_locates_single_atom(self):
+    """Tests the heatmap concentrates on an atom pinned down by a few shots"""
+    heatmap = self._observe(BlackBoxGame([(4,4)]), AtomHeatmap(1, seed=7), [(0,4), (4,0), (0,2), (9,6)])
+
+    self.assertGreater(heatmap[3][3], 0.9)
+    self.assertAlmostEqual(sum(map(sum, heatmap)), 1)
+
+  def test_seeded_reproducible(self):
+    """Tests heatmaps sampled with the same seed are identical"""
+    origins = [(0,3), (5,9), (9,6)]
+    layout = [(2,6), (3,3), (7,6)]
+
+    first = self._observe(BlackBoxGame(layout), AtomHeatmap(3, samples=100, seed=3), origins)
+    second = self._observe(BlackBoxGame(layout), AtomHeatmap(3, samples=100, seed=3), origins)
+
+    self.assertEqual(first, second)
+
+  def test_large_board(self):
+    """Tests a heatmap on a 12x12 board agrees with the shots and guesses"""
+    game = BlackBoxGame([(3,3), (9,10), (6,11)], side_length=12)
+    sampler = AtomHeatmap(3, side_length=12, samples=200, seed=1)
+    sampler.observe_guess(3, 3, game.guess_atom(3, 3))
+    sampler.observe_guess(5, 5, game.guess_atom(5, 5))
+
+    heatmap = self._observe(game, sampler, [(0,3), (9,0), (6,13), (13,10), (0,8)])
+
+    self.assertEqual(len(heatmap), 12)
+    self.assertEqual(len(heatmap[0]), 12)
+    self.assertGreater(sampler.get_sample_count(), 0)
+    self.assertAlmostEqual(sum(map(sum, heatmap)), 3)
+    self.assertEqual(heatmap[2][2], 1)
+    self.assertEqual(heatmap[4][4], 0)
+
+  def test_rejects_impossible_guesses(self):
+    """Tests guesses that were not made or contradict what is known are rejected without changing the heatmap"""
+    game = BlackBoxGame([(4,4)])
+    sampler = AtomHeatmap(1, seed=2)
+    for col in range(1, 6):
+      sampler.observe_guess(1, col, game.guess_atom(1, col))
+    sampler.observe_guess(4, 4, True)
+
+    with self.assertRaises(ValueError):
+      sampler.observe_guess(5, 5, game.guess_atom(5, 5)) # not enough points left
+    with self.assertRaises(ValueError):
+      sampler.observe_guess(5, 5, True) # a second atom
+    with self.assertRaises(ValueError):
+      sampler.observe_guess(4, 4, False)
+    self.assertEqual(sampler.update()[3][3], 1)
+
+
+class SQLiteEventSinkTest(unittest.TestCase):
+  """Unit tests for SQLiteEventSink class
+  """
+  def setUp(self):
+    self._directory = tempfile.TemporaryDirectory()
+    self._path = os.path.join(self._directory.name, 'events.db')
+
+  def tearDown(self):
+    self._directory.cleanup()
+
+  def _rows(self):
+    """Reads back the recorded events"""
+    connection = sqlite3.connect(self._path)
+    rows = connection.execute("SELECT game_id, kind, row, col, result, score FROM events ORDER BY id").fetchall()
+    connection.close()
+    return rows
+
+  def test_records_game(self):
+    """Tests shots, guesses and the final score are written once flushed"""
+    with SQLiteEventSink(self._path) as sink:
+      game = BlackBoxGame([(4,4)], event_sink=sink, game_id='game-1')
+      game.shoot_ray(0, 4)
+      game.shoot_ray(0, 3)
+      game.guess_atom(1, 1)
+      game.guess_atom(4, 4)
+      sink.flush()
+
+      self.assertEqual(self._rows(), [
+        ('game-1', 'shot', 0, 4, 'hit', 24),
+        ('game-1', 'shot', 0, 3, '3,0', 22),
+        ('game-1', 'guess', 1, 1, 'false', 17),
+        ('game-1', 'guess', 4, 4, 'true', 17),
+        ('game-1', 'final', None, None, None, 17),
+      ])
+
+  def test_close_writes_queued_events(self):
+    """Tests closing writes out every queued event in batches"""
+    sink = SQLiteEventSink(self._path, batch_size=100)
+    for index in range(1000):
+      sink.record(str(index), 'shot', 0, 1, None, 24)
+    sink.close()
+
+    self.assertEqual(len(self._rows()), 1000)
+    with self.assertRaises(RuntimeError):
+      sink.record('late', 'shot', 0, 1, None, 24)
+
+  def test_drops_when_full(self):
+    """Tests a non-blocking sink drops events once the queue is full"""
+    with SQLiteEventSink(self._path, max_queue=0, block=False) as sink:
+      sink.record('game-1', 'shot', 0, 1, None, 24)
+
+      self.assertEqual(sink.get_dropped(), 1)
+
+  def test_threads_account_for_every_event(self):
+    """Tests events offered from many threads to a small queue are each either written or counted as dropped"""
+    sink = SQLiteEventSink(self._path, max_queue=50, block=False, flush_interval=0.0001)
+    self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+    sys.setswitchinterval(1e-6) # switch threads often enough to interleave the checks
+    def offer(thread):
+      return sum(sink.offer(str(thread), 'shot', 0, 1, None, 24) for _ in range(10000))
+    with ThreadPoolExecutor(8) as executor:
+      queued = sum(executor.map(offer, range(8)))
+    sink.close()
+
+    self.assertEqual(len(self._rows()), queued)
+    self.assertEqual(queued + sink.get_dropped(), 80000)
+
+  def test_flush_during_close(self):
+    """Tests flushing while another thread closes the sink returns once the events are written"""
+    self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+    sys.setswitchinterval(1e-6)
+    for _ in range(20):
+      sink = SQLiteEventSink(self._path)
+      sink.record('game-1', 'shot', 0, 1, None, 24)
+      with ThreadPoolExecutor(4) as executor:
+        flushes = [executor.submit(sink.flush) for _ in range(3)]
+        sink.close()
+        for flush in flushes:
+          flush.result(timeout=5)
+    self.assertEqual(len(self._rows()), 20)
+
+  def test_game_counts_failures_as_dropped(self):
+    """Tests a game keeps playing when its events can't be recorded, counting them as dropped"""
+    with SQLiteEventSink(self._path, max_queue=0, timeout=0.01) as sink:
+      game = BlackBoxGame([(4,4)], event_sink=sink, game_id='game-1')
+      self.assertEqual(game.shoot_ray(0, 3), (3, 0))
+      self.assertEqual(sink.get_dropped(), 1)
+      with self.assertRaises(queue.Full):
+        sink.record('game-1', 'shot', 0, 3, (3, 0), 23)
+    self.assertIs(game.guess_atom(4, 4), True)
+    self.assertEqual(game.get_score(), 23)
+    self.assertEqual(sink.get_dropped(), 3) # the guess and the final score after closing
+
+  def test_finish_records_final_once(self):
+    """Tests finish records the final score of a game stopped early, and only once"""
+    with SQLiteEventSink(self._path) as sink:
+      game = BlackBoxGame([(4,4), (6,6)], event_sink=sink, game_id='game-1')
+      game.guess_atom(4, 4)
+      self.assertEqual(game.finish(), 25)
+      game.guess_atom(6, 6)
+      game.finish()
+      sink.flush()
+
+      self.assertEqual([row[1] for row in self._rows()], ['guess', 'final', 'guess'])
+
+
+class LoadGeneratorTest(unittest.TestCase):
+  """Unit tests for LatencyHistogram and LoadGenerator classes
+  """
+  def test_histogram_percentiles(self):
+    """Tests percentiles fall within a bucket's width of the exact value and merge across histograms"""
+    first = LatencyHistogram()
+    second = LatencyHistogram()
+    for nanoseconds in range(1, 1001):
+      first.record(nanoseconds * 1000)
+    second.record(5000000)
+    first.merge(second)
+
+    self.assertEqual(first.get_count(), 1001)
+    self.assertEqual(first.get_max(), 5000000)
+    self.assertAlmostEqual(first.get_percentile(50), 500000, delta=500000 * 0.0625)
+    self.assertAlmostEqual(first.get_percentile(99), 990000, delta=990000 * 0.0625)
+    self.assertEqual(first.get_percentile(100), 5000000)
+    self.assertEqual(LatencyHistogram().get_percentile(99), 0)
+
+  def test_modes(self):
+    """Tests every concurrency mode times both operations and samples memory while running"""
+    for mode in ('threads', 'asyncio', 'processes'):
+      report = LoadGenerator(players=2, mode=mode, duration=0.3, sample_interval=0.05, seed=1).run()
+
+      self.assertEqual(report['mode'], mode)
+      for operation in ('shoot_ray', 'guess_atom'):
+        stats = report['operations'][operation]
+        self.assertGreater(stats['count'], 0)
+        self.assertLessEqual(stats['p50_us'], stats['p999_us'])
+        self.assertLessEqual(stats['p999_us'], stats['max_us'])
+      self.assertGreater(report['memory']['end_bytes'], 0)
+      elapsed = [seconds for seconds, _ in report['memory']['samples']]
+      self.assertGreater(len(elapsed), 3)
+      self.assertEqual(elapsed, sorted(elapsed))
+
+    with self.assertRaises(ValueError):
+      LoadGenerator(mode='fibers')
+
+
+class TrajectoryTest(unittest.TestCase):
+  """Unit tests for Trajectory class
+  """
+  def test_deflected_ray_segments(self):
+    """Tests a deflected ray is stored as one segment per straight run"""
+    game = BlackBoxGame([(4,4)])
+    game.shoot_ray(0, 3)
+    trajectory = game.get_trajectory()
+
+    self.assertEqual(trajectory.get_segments(), [((1,3), 'south', 3), ((3,2), 'west', 2)])
+    self.assertEqual(list(trajectory), [(1,3), (2,3), (3,3), (3,2), (3,1)])
+    self.assertEqual(len(trajectory), 5)
+    self.assertIn((2,3), trajectory)
+    self.assertNotIn((3,4), trajectory)
+    self.assertNotIn((4,3), trajectory)
+    self.assertTrue(trajectory.rasterise(10)[3][1])
+    self.assertEqual(Trajectory(trajectory.get_segments()), trajectory)
+
+  def test_revisits_counted(self):
+    """Tests positions visited twice are counted and iterated twice, and trajectories can't be hashed"""
+    trajectory = Trajectory()
+    for coord in [(1,1), (1,2), (1,1)]:
+      trajectory.add(coord)
+
+    self.assertEqual(list(trajectory), [(1,1), (1,2), (1,1)])
+    self.assertEqual(len(trajectory), 3)
+    self.assertEqual(len(set(trajectory)), 2)
+    with self.assertRaises(TypeError):
+      hash(trajectory)
+
+  def test_long_straight_ray(self):
+    """Tests a ray crossing a large board takes a single segment and is replaced by the next shot"""
+    game = BlackBoxGame([(5,5)], side_length=40)
+    game.shoot_ray(0, 20)
+
+    self.assertEqual(game.get_trajectory().get_segments(), [((1,20), 'south', 40)])
+    self.assertIn((40,20), game.get_trajectory())
+
+    game.shoot_ray(5, 0)
+    self.assertEqual(game.get_trajectory().get_segments(), [((5,1), 'east', 4)])
+
+
+class BulkScorerTest(unittest.TestCase):
+  """Unit tests for BulkScorer class
+  """
+  def test_scores_match_games(self):
+    """Tests bulk scores and atoms left match the games the events were recorded from, points floors included"""
+    layouts = [[(2,5), (7,8)], [(4,4)], [(3,3)]]
+    moves = [
+      [('shot', 0, 5), ('shot', 0, 5), ('guess', 2, 5), ('guess', 2, 5), ('guess', 7, 8)],
+      [('guess', 1, col) for col in range(1, 6)] + [('shot', 0, 4), ('shot', 0, 3), ('shot', 4, 0)],
+      [('shot', 0, 2), ('shot', 3, 0), ('shot', 0, 4)] + [('guess', 8, col) for col in range(1, 6)] + [('shot', 9, 2)],
+    ]
+    games = []
+    events = ScoringEvents()
+    for index, (atoms, game_moves) in enumerate(zip(layouts, moves)):
+      game = BlackBoxGame(atoms)
+      table = RayTablePublisher.compute_table(atoms)
+      origins = Board.ray_origins(10)
+      for kind, row, col in game_moves:
+        if kind == 'shot':
+          result = game.shoot_ray(row, col)
+          outcome = table[origins.index((row, col))]
+          exit = None if outcome >= HIT_CELL else origins[outcome]
+          events.add_shot(index, row, col, (row, col) if outcome == REFLECT else exit, outcome == REFLECT)
+        else:
+          game.guess_atom(row, col)
+          events.add_guess(index, row, col, (row, col) in atoms)
+      games.append(game)
+
+    scores, atoms_left = BulkScorer.score(len(games), [len(atoms) for atoms in layouts], events)
+    self.assertEqual(list(scores), [game.get_score() for game in games])
+    self.assertEqual(list(atoms_left), [game.atoms_left() for game in games])
+    self.assertEqual(list(atoms_left), [0, 1, 1])
+
+  def test_rejects_positions_off_the_board(self):
+    """Tests positions of larger boards are rejected rather than packed into cells of other positions"""
+    events = ScoringEvents()
+
+    with self.assertRaises(ValueError):
+      events.add_guess(0, 1, 10, True) # would share a cell with (2,0)
+    with self.assertRaises(ValueError):
+      events.add_shot(0, 0, 4, (11,4))
+    events.add_shot(0, 0, 11, (11,4)) # not an origin, no points charged
+    self.assertEqual(len(events), 0)
+
+  def test_leaderboard(self):
+    """Tests the leaderboard ranks the best scores first, ties in game order, optionally finished games only"""
+    scores = [3, 20, 7, 20, 25, -1]
+    atoms_left = [0, 1, 0, 0, 2, 0]
+
+    self.assertEqual(BulkScorer.leaderboard(scores, 3), [(4, 25), (1, 20), (3, 20)])
+    self.assertEqual(BulkScorer.leaderboard(scores, 2, atoms_left), [(3, 20), (2, 7)])
+    self.assertEqual(BulkScorer.leaderboard(scores, 0), [])
+
+
+class SpectatorStreamTest(unittest.TestCase):
+  """Unit tests for SpectatorStream class
+  """
+  def test_deltas_rebuild_view(self):
+    """Tests spectators rebuild the board view from deltas sent once to every subscriber"""
+    game = BlackBoxGame([(4,4), (7,2)])
+    stream = SpectatorStream(game)
+    views = [SpectatorView(), SpectatorView()]
+    frames = []
+    stream.subscribe(views[0].apply)
+    stream.subscribe(views[1].apply)
+    stream.subscribe(frames.append)
+
+    for move, row, col in [('shot', 0, 3), ('shot', 0, 5), ('guess', 4, 4), ('guess', 5, 5), ('shot', 9, 2)]:
+      if move == 'shot':
+        game.shoot_ray(row, col)
+      else:
+        game.guess_atom(row, col)
+      stream.publish()
+      for view in views:
+        self.assertEqual(view.get_trajectory(), set(game.get_trajectory()))
+        self.assertEqual(view.get_guesses(), game.get_guesses())
+        self.assertEqual(view.get_score(), game.get_score())
+
+    self.assertEqual(len(frames), 6)
+    self.assertEqual(frames[3], b'{"n":3,"g":[[4,4,1]]}')
+    self.assertIsNone(stream.publish()) # nothing changed
+
+  def test_keyframes_recover_missed_frames(self):
+    """Tests a spectator missing a frame waits for the next keyframe"""
+    game = BlackBoxGame([(4,4)])
+    stream = SpectatorStream(game, keyframe_interval=3)
+    frames = []
+    stream.subscribe(frames.append)
+    for row, col in Board.ray_origins(10)[:6]:
+      game.shoot_ray(row, col)
+      stream.publish()
+
+    view = SpectatorView()
+    applied = [view.apply(frame) for index, frame in enumerate(frames) if index != 1]
+    self.assertEqual(applied, [True, False, True, True, True, True])
+    self.assertEqual(view.get_trajectory(), set(game.get_trajectory()))
+    self.assertEqual(view.get_score(), game.get_score())
+
+
+class ConcurrentShootingTest(unittest.TestCase):
+  """Unit tests for tracing rays and shooting them from many threads
+  """
+  def test_trace_leaves_board_unchanged(self):
+    """Tests tracing returns what the game does without touching the board"""
+    atoms = [(4,4), (2,6), (7,2)]
+    board = Board(10, atoms).get_board()
+    snapshot = [row[:] for row in board]
+    laser = LaserController()
+
+    for row, col in Board.ray_origins(10):
+      game = BlackBoxGame(atoms)
+      result = game.shoot_ray(row, col)
+      pos, direction, hit, trajectory = laser.trace(board, row, col)
+      self.assertEqual(None if hit else pos, result)
+      self.assertEqual(direction, game.get_current_direction())
+      self.assertEqual(trajectory, game.get_trajectory())
+    self.assertEqual(board, snapshot)
+
+  def test_deprecated_step_api(self):
+    """Tests the deprecated step by step API warns and still walks rays to where trace ends them"""
+    atoms = [(4,4), (2,6)]
+    board = Board(10, atoms).get_board()
+    with self.assertWarns(DeprecationWarning):
+      BlackBoxGame(atoms).set_current_pos((0,3))
+
+    with warnings.catch_warnings():
+      warnings.simplefilter('ignore', DeprecationWarning)
+      for row, col in [(0,3), (0,4), (0,5), (5,9)]:
+        game = BlackBoxGame(atoms)
+        laser = LaserController()
+        game.set_current_pos((row, col))
+        game.set_current_direction(laser.set_initial_direction(row, col))
+        if not laser.check_border_reflection(board, game.get_current_direction, game.get_current_pos, game.set_current_direction):
+          while True:
+            laser.traverse(board, game.get_current_direction, game.get_current_pos, game.set_current_pos, game.set_hit_location)
+            row_now, col_now = game.get_current_pos()
+            if board[row_now][col_now] == 'o' or Board.check_valid_ray_origin(board, row_now, col_now):
+              break
+            laser.add_trajectory_coord(game.get_current_pos())
+            laser.get_scan_method(game.get_current_direction)(board, game.get_current_pos, game.set_current_direction)
+        pos, direction, hit, trajectory = laser.trace(board, row, col)
+        self.assertEqual((game.get_current_pos(), game.get_current_direction()), (pos, direction))
+        if not hit:
+          self.assertEqual(list(laser.get_trajectory()), list(trajectory))
+
+  def test_threads_share_a_game(self):
+    """Tests threads shooting and guessing on one game get the same results and score as one thread"""
+    atoms = [(4,4), (2,6), (7,2)]
+    moves = [('shot', row, col) for row, col in Board.ray_origins(10)[::3]] + [('guess', 4, 4), ('guess', 5, 5)]
+    expected = BlackBoxGame(atoms)
+    expected_results = [getattr(expected, 'shoot_ray' if kind == 'shot' else 'guess_atom')(row, col) for kind, row, col in moves]
+
+    game = BlackBoxGame(atoms)
+    def play(_):
+      return [getattr(game, 'shoot_ray' if kind == 'shot' else 'guess_atom')(row, col) for kind, row, col in moves * 20]
+    with ThreadPoolExecutor(8) as executor:
+      for results in executor.map(play, range(8)):
+        self.assertEqual(results, expected_results * 20)
+    self.assertEqual(game.get_score(), expected.get_score())
+    self.assertEqual(game.atoms_left(), 2)
+
+
+class LayoutStoreTest(unittest.TestCase):
+  """Unit tests for LayoutStore class
+  """
+  def test_round_trip(self):
+    """Tests layouts and signature columns read back by index, in chunks and filtered"""
+    layouts = [[(2,5), (7,8)], [(4,4)], [(1,1), (8,8), (3,6)], [(5,5), (5,6)]]
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, 'layouts.bbls')
+      with LayoutStoreWriter(path, {'atoms': 'B'}, chunk_size=3) as writer:
+        for layout in layouts:
+          writer.append(Board.atom_mask(layout) if len(layout) == 1 else layout, atoms=len(layout))
+      self.assertEqual(os.listdir(directory), ['layouts.bbls'])
+
+      with LayoutStore(path) as store:
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store.get_columns(), ['atoms'])
+        self.assertEqual(sorted(Board.mask_locations(store[2])), [(1,1), (3,6), (8,8)])
+        self.assertEqual(store.get_value('atoms', 2), 3)
+        self.assertEqual([(start, list(chunk)) for start, chunk in store.iter_chunks(3, 'atoms')], [(0, [2, 1, 3]), (3, [2])])
+        self.assertEqual(list(store.filter(lambda atoms: atoms == 2, 'atoms')), [0, 3])
+        self.assertEqual(list(store.filter(lambda mask: mask & Board.atom_mask([(4,4)]))), [1])
+
+      with self.assertRaises(ValueError):
+        LayoutStore(__file__)
+
+  def test_rejected_values_keep_columns_aligned(self):
+    """Tests a layout whose values are rejected is not written, so later layouts keep their values"""
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, 'layouts.bbls')
+      with LayoutStoreWriter(path, {'atoms': 'B', 'score': 'h'}) as writer:
+        writer.append([(4,4)], atoms=1, score=5)
+        with self.assertRaises(OverflowError):
+          writer.append([(5,5)], atoms=300, score=6)
+        writer.append([(6,6)], atoms=1, score=7)
+
+      with LayoutStore(path) as store:
+        self.assertEqual(len(store), 2)
+        self.assertEqual([store.get_value('atoms', index) for index in range(2)], [1, 1])
+        self.assertEqual([store.get_value('score', index) for index in range(2)], [5, 7])
+
+  def test_game_from_mask(self):
+    """Tests a game built from a mask plays like one built from atom locations"""
+    atoms = [(2,5), (7,8), (4,4)]
+    mask = Board.atom_mask(atoms)
+    game = BlackBoxGame(mask)
+    expected = BlackBoxGame(atoms)
+
+    self.assertEqual(Board(10, mask).get_board(), Board(10, atoms).get_board())
+    self.assertIs(game.guess_atom(4,4), True)
+    self.assertEqual(game.atoms_left(), 2)
+    game.guess_atom(2,5)
+    game.guess_atom(7,8)
+    self.assertEqual(game.atoms_left(), 0)
+    for row, col in Board.ray_origins(10):
+      self.assertEqual(game.shoot_ray(row, col), expected.shoot_ray(row, col))
+    with self.assertRaises(ValueError):
+      Board(10, 1 << 64)
+
+
 if __name__ == '__main__':
   unittest.main()